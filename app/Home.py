@@ -3,6 +3,7 @@
 
 import json
 import os
+import re
 from datetime import datetime
 from typing import List
 
@@ -10,9 +11,11 @@ import streamlit as st
 from dotenv import find_dotenv, load_dotenv
 from streamlit.logger import get_logger
 
-from pickpod.api import ClaudeClient
-from pickpod.config import DBClient
+from pickpod.api import ClaudeCache, ClaudeClient
+from pickpod.config import DBCache, DBClient, DBUnit
 from pickpod.draft import *
+from pickpod.media import PickpodMedia
+from pickpod.rank import PickpodRank
 
 
 os.chdir(os.path.split(os.path.realpath(__file__))[0])
@@ -24,12 +27,13 @@ HTTP_PROXY = os.getenv("HTTP_PROXY")
 
 LOGGER = get_logger(__name__)
 
-PPDB = DBClient("./data")
-PPTB = ["audio", "formation", "sentence"]
 
-tb = [PPDB.fetchone(x, y)[0] for x, y in [DBClient.find_tb(z) for z in PPTB]]
-if not (tb[0] and tb[1] and tb[2]):
-    PPDB.create_tb()
+# 数据库读缓存由连接池持有，各会话与页面共享同一份
+PPDB = DBClient("./data", db_cache=DBCache())
+# 交由 Claude 精排的播客数量上限
+RANK_TOP = 60
+
+PPDB.migrate()
 
 if not os.path.exists("./data/audio"):
     os.mkdir("./data/audio")
@@ -40,11 +44,34 @@ if not os.path.exists("./data/wav"):
 DATA_PATH = os.path.abspath(os.path.join(os.path.realpath(__file__), os.pardir, "data"))
 
 
+# 进程内共享的媒体服务，以 HTTP Range 方式向浏览器提供音频，与本应用监听相同的网卡
+# 本页以 __main__ 运行而其他页面以 Home 导入，由 PickpodMedia 按地址持有唯一实例，各页面签发的链接才能通过校验
+def get_media_server() -> PickpodMedia:
+    return PickpodMedia.get_media(DATA_PATH, st.get_option("server.address") or "", int(os.getenv("PICKPOD_MEDIA_PORT", 8052)))
+
+
+# 浏览器访问媒体服务的地址，默认沿用当前请求的主机名
+def get_media_url() -> str:
+    if os.getenv("PICKPOD_MEDIA_URL"):
+        return os.getenv("PICKPOD_MEDIA_URL")
+    media_host = re.sub(r":\d+$", "", st.context.headers.get("Host", "127.0.0.1"))
+    media_proto = st.context.headers.get("X-Forwarded-Proto", "http")
+    return f"{media_proto}://{media_host}:{get_media_server().port}"
+
+
 def index(df_recommend: List[str], pp_db: DBClient = PPDB) -> None:
 
-    for df_uuid in df_recommend:
+    audio_dict = AudioDraft.group_by_uuid(pp_db.fetchall_chunk(AudioDraft.select_by_uuids(df_recommend)))
+    view_dict = ViewDraft.group_by_aid(pp_db.fetchall_chunk(ViewDraft.select_formation_by_aids(df_recommend)))
 
-        audio_draft: AudioDraft = AudioDraft.db_init([pp_db.fetchone(x, y) for x, y in [AudioDraft.select_by_uuid(df_uuid)]][0])
+    # 仅写回本次交互中被修改的观点
+    db_unit = DBUnit(pp_db)
+    for x in view_dict.values():
+        db_unit.register(x)
+
+    for df_uuid in [x for x in df_recommend if x in audio_dict]:
+
+        audio_draft: AudioDraft = audio_dict[df_uuid]
 
         with st.expander(f"**标题**：{audio_draft.title}（{audio_draft.origin}任务）\n\n**描述**：{audio_draft.description}"):
 
@@ -68,7 +95,7 @@ def index(df_recommend: List[str], pp_db: DBClient = PPDB) -> None:
 
             st.caption("观点交互", help="请评价由音频中提取出的若干条观点对您的价值")
 
-            view_draft: List[ViewDraft] = [ViewDraft.db_init(vd) for vd in [pp_db.fetchall(x, y) for x, y in [ViewDraft.select_by_aid(audio_draft.uuid)]][0]]
+            view_draft: List[ViewDraft] = view_dict.get(audio_draft.uuid, list())
 
             wiki_add = [True for _ in view_draft]
 
@@ -81,31 +108,26 @@ def index(df_recommend: List[str], pp_db: DBClient = PPDB) -> None:
 
             wiki_save = st.button("保存到知识库", f"button_{audio_draft.uuid}", "已勾选的指定观点表述将被保存到您的知识库集合", use_container_width=True)
             if wiki_save:
-                for x, y in [
-                    WikiDraft(
-                        wiki_aid=vd.aid, wiki_content=vd.content, wiki_value=vd.value
-                        ).insert() for i, vd in enumerate(view_draft) if wiki_add[i]
-                    ]:
-                    pp_db.execute(x, y)
+                for vd in [vd for i, vd in enumerate(view_draft) if wiki_add[i]]:
+                    db_unit.add(WikiDraft(wiki_aid=vd.aid, wiki_content=vd.content, wiki_value=vd.value))
                 st.success("您勾选的观点已被保存到知识库集合。", icon="✅")
 
-        for x, y in [z.update() for z in view_draft]:
-            pp_db.execute(x, y)
+    db_unit.flush()
 
 
 def wiki_gallery(pp_db: DBClient = PPDB) -> None:
 
     with st.expander("查看我的知识库"):
 
-        wiki_draft: List[WikiDraft] = [WikiDraft.db_init(x) for x in pp_db.fetchall(WikiDraft.select_all())]
+        db_unit = DBUnit(pp_db)
+        wiki_draft: List[WikiDraft] = db_unit.register([WikiDraft.db_init(x) for x in pp_db.fetchall(WikiDraft.select_all())])
 
         with st.form("编辑我的知识库", True):
             wiki_content = st.text_input("编辑我的知识库", "", help="您可以直接在此处向您的知识库新增观点", placeholder="请在此处输入新增观点的内容，并在下方评价其对您的价值")
             wiki_mark = st.toggle("是否有效", True)
             wiki_submit = st.form_submit_button("添加到我的知识库", help="您的知识库将新增一条观点表述", use_container_width=True)
             if wiki_submit:
-                x, y = WikiDraft(wiki_content=wiki_content, wiki_value=wiki_mark).insert()
-                pp_db.execute(x, y)
+                db_unit.add(WikiDraft(wiki_content=wiki_content, wiki_value=wiki_mark))
 
         wiki_remove = [False for _ in wiki_draft]
 
@@ -118,16 +140,11 @@ def wiki_gallery(pp_db: DBClient = PPDB) -> None:
 
         wiki_delete = st.button("从我的知识库中删除", help="已勾选的指定观点表述将从您的知识库集合中删除", use_container_width=True)
         if wiki_delete:
-            for i, wd in enumerate(wiki_draft):
-                if wiki_remove[i]:
-                    x, y = WikiDraft.delete_status(wd.uuid)
-                else:
-                    x, y = wd.update()
-                pp_db.execute(x, y)
+            for wd in [wd for i, wd in enumerate(wiki_draft) if wiki_remove[i]]:
+                db_unit.remove(wd)
+        db_unit.flush()
+        if wiki_delete:
             st.success("您勾选的观点已从知识库集合中删除。", icon="✅")
-        else:
-            for x, y in [z.update() for z in wiki_draft]:
-                pp_db.execute(x, y)
 
 
 def run() -> None:
@@ -168,12 +185,11 @@ def run() -> None:
                 ] if len(pp_date) == 2 else list()
 
             with st.expander(f"本次推荐共涉及{len(pp_list)}篇播客"):
-                pp_select = st.selectbox("您可以在以下播客中选择需要推荐的具体范围", [True, False], format_func=lambda x: "全选" if x else "全不选", help="若取消勾选，则对应播客不会出现在排序结果中（建议一次性选择不超过20条）")
+                pp_select = st.selectbox("您可以在以下播客中选择需要推荐的具体范围", [True, False], format_func=lambda x: "全选" if x else "全不选", help=f"若取消勾选，则对应播客不会出现在排序结果中（本地粗排后仅前{RANK_TOP}条交由 Claude 精排）")
+                audio_dict = AudioDraft.group_by_uuid(PPDB.fetchall_chunk(AudioDraft.select_by_uuids(pp_list)))
                 audio_select = [
                     st.checkbox(ad.title, pp_select, f"checkbox_{ad.uuid}", help="; ".join(ad.keyword.split("\n"))) for ad in [
-                        AudioDraft.db_init(PPDB.fetchone(x, y)) for x, y in [
-                            AudioDraft.select_by_uuid(z) for z in pp_list
-                            ]
+                        audio_dict[z] for z in pp_list
                         ]
                     ]
 
@@ -181,43 +197,46 @@ def run() -> None:
 
             if pp_recommend:
 
-                claude_client = ClaudeClient(CLAUDE_KEY, HTTP_PROXY)
+                claude_client = ClaudeClient(CLAUDE_KEY, HTTP_PROXY, ClaudeCache.get_cache("./data"))
 
                 pp_list = [pp_list[x] for x, y in enumerate(audio_select) if y]
 
-                if pp_mode:
-
-                    pp_sort = claude_client.get_recommend_wiki(
-                        [
-                            " ".join([SentenceDraft.db_init(s).content for s in sd]) for sd in [
-                                PPDB.fetchall(x, y) for x, y in [SentenceDraft.select_by_aid(z) for z in pp_list]
-                                ]
-                            ],
-                        {
-                            True: [
-                                WikiDraft.db_init(wd).content for wd in [
-                                    PPDB.fetchall(x, y) for x, y in [WikiDraft.select_by_value(1)]
-                                    ][0]
-                                ],
-                            False: [
-                                WikiDraft.db_init(wd).content for wd in [
-                                    PPDB.fetchall(x, y) for x, y in [WikiDraft.select_by_value(0)]
-                                    ][0]
-                                ],
-                            }
-                    )
-
-                else:
-
-                    pp_sort = claude_client.get_recommend_none(
-                        [
-                            " ".join([SentenceDraft.db_init(s).content for s in sd]) for sd in [
-                                PPDB.fetchall(x, y) for x, y in [SentenceDraft.select_by_aid(z) for z in pp_list]
-                                ]
-                            ]
-                        )
-
-                df_wiki["pp_recommend"] = [pp_list[x] for x in pp_sort]
+                pp_view = {
+                    True: [
+                        WikiDraft.db_init(wd).content for wd in [
+                            PPDB.fetchall(x, y) for x, y in [WikiDraft.select_by_value(1)]
+                            ][0]
+                        ],
+                    False: [
+                        WikiDraft.db_init(wd).content for wd in [
+                            PPDB.fetchall(x, y) for x, y in [WikiDraft.select_by_value(0)]
+                            ][0]
+                        ],
+                    } if pp_mode else dict()
+
+                sentence_dict = SentenceDraft.group_by_aid(PPDB.fetchall_chunk(SentenceDraft.select_sentences_by_aids(pp_list)))
+                view_dict = ViewDraft.group_by_aid(PPDB.fetchall_chunk(ViewDraft.select_formation_by_aids(pp_list)))
+                summary_dict = SummaryDraft.group_by_aid(PPDB.fetchall_chunk(SummaryDraft.select_formation_by_aids(pp_list)))
+
+                pp_doc = {
+                    z: (
+                        " ".join([s.content for s in sentence_dict.get(z, list())]),
+                        [v.content for v in view_dict.get(z, list())],
+                        [s.content for s in summary_dict.get(z, list())]
+                        ) for z in pp_list
+                    }
+
+                # 先在本地按知识库观点粗排，再将前若干篇的观点和摘要交由 Claude 精排
+                pp_rank = PickpodRank({x: " ".join([y[0]] + y[1] + y[2]) for x, y in pp_doc.items()}).get_rank(pp_view)
+
+                pp_top = pp_rank[:RANK_TOP]
+
+                pp_brief = [PickpodRank.get_brief(pp_doc[x][1], pp_doc[x][2], pp_doc[x][0]) for x in pp_top]
+
+                # 按每组10篇并行排序，逐轮晋级合并
+                pp_sort = claude_client.get_recommend_tournament(pp_brief, pp_view)
+
+                df_wiki["pp_recommend"] = [pp_top[x] for x in pp_sort] + pp_rank[RANK_TOP:]
 
         else:
 
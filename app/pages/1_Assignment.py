@@ -13,10 +13,10 @@ import streamlit as st
 from dotenv import find_dotenv, load_dotenv
 from Home import DATA_PATH
 
-from pickpod.config import YDL_OPTION, TaskConfig
+from pickpod.batch import PickpodBatch
+from pickpod.config import TaskConfig
 from pickpod.draft import AudioDraft
 from pickpod.task import PickpodTask
-from pickpod.utils import PickpodUtils
 
 
 os.chdir(os.path.split(os.path.realpath(__file__))[0])
@@ -27,15 +27,12 @@ HUGGING_FACE_KEY = os.getenv("HUGGING_FACE_KEY")
 CLAUDE_KEY = os.getenv("CLAUDE_KEY")
 LISTEN_NOTE_KEY = os.getenv("LISTEN_NOTE_KEY")
 HTTP_PROXY = os.getenv("HTTP_PROXY")
+PYANNOTE_PATH = os.getenv("PYANNOTE_PATH")
+CLAUDE_CHUNK = int(os.getenv("CLAUDE_CHUNK") or 0)
 
 
 def my_pickpod_task(pickpod_list: List[PickpodTask]) -> None:
-    for pickpod_task in pickpod_list:
-        try:
-            pickpod_task.pickpod_all_task()
-            pickpod_task.save_to_db()
-        except Exception as e:
-            print("Pickpod task failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+    PickpodBatch(pickpod_list).run()
 
 def task_set(ln_q, ln_sort_by_date=None, ln_num=None, ln_len_min=None, ln_len_max=None, ln_published_before=None, ln_published_after=None, ln_only_in=None, ln_language=None, ln_region=None, ln_safe_mode=None, ln_unique_podcasts=None, pp_start=None, pp_period=None, pp_language=None, pp_prompt=None, pp_pipeline=None, pp_keyword=None, pp_summary=None, pp_view=None) -> None:
     task_dict = {
@@ -199,10 +196,15 @@ elif not click_save and click_do and not click_clean:
             key_hugging_face=HUGGING_FACE_KEY,
             key_claude=CLAUDE_KEY,
             path_wav=os.path.join(DATA_PATH, "wav"),
+            path_audio=os.path.join(DATA_PATH, "audio"),
             path_db=DATA_PATH,
+            path_pyannote=PYANNOTE_PATH,
             task_language=pp_language,
             task_prompt=pp_prompt,
             task_proxy=HTTP_PROXY,
+            claude_cache=True,
+            claude_chunk=CLAUDE_CHUNK,
+            claude_combine=True,
             pipeline=pp_pipeline,
             keyword=pp_keyword,
             summary=pp_summary,
@@ -211,7 +213,6 @@ elif not click_save and click_do and not click_clean:
 
         for podcast in task_pp_list:
             st.json(podcast, expanded=False)
-            st.caption("请等待将存储音频文件到本地", unsafe_allow_html=False)
             audio_draft = AudioDraft(
                 audio_title=podcast.get("title_original", ""),
                 audio_web=podcast.get("listennotes_url", ""),
@@ -219,15 +220,9 @@ elif not click_save and click_do and not click_clean:
                 audio_duration=podcast.get("audio_length_sec", 0),
                 audio_description=re.sub(r"<[^>]*?>", "", podcast.get("description_original", "")),
                 audio_origin="定时")
-            if task_config.proxy:
-                YDL_OPTION["proxy"] = task_config.proxy
-            YDL_OPTION["outtmpl"] = f"{DATA_PATH}/audio/{audio_draft.uuid}.%(ext)s"
-            try:
-                PickpodUtils.pickpod_ytdlp(audio_draft, YDL_OPTION)
-                st.info(f"ℹ️ 音频文件下载完成")
-                pickpod_list.append(PickpodTask(audio_draft, task_config))
-            except Exception as e:
-                st.error("音频文件下载失败，已跳过。错误码：{}，错误信息：{}。".format(e.args[0], e.args[-1]))
+            pickpod_list.append(PickpodTask(audio_draft, task_config))
+
+        st.caption("音频文件将在后台边下载边转录", unsafe_allow_html=False)
 
         pickpod_thread = threading.Thread(target=my_pickpod_task, args=(pickpod_list, ))
         pickpod_thread.start()
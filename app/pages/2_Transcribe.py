@@ -2,18 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import os
-import threading
 import time
-from queue import Queue
 
 import streamlit as st
 from dotenv import find_dotenv, load_dotenv
 from Home import DATA_PATH
-from pydub import AudioSegment
 
-from pickpod.api import ClaudeClient
-from pickpod.config import YDL_OPTION, DBClient, TaskConfig
+from pickpod.api import s2t
+from pickpod.batch import PickpodBatch
+from pickpod.config import TaskConfig
 from pickpod.draft import AudioDraft, SentenceDraft, SummaryDraft, ViewDraft
+from pickpod.task import STAGE_TASK, PickpodTask
 from pickpod.utils import PickpodUtils
 
 
@@ -24,6 +23,8 @@ load_dotenv(find_dotenv(), override=True)
 HUGGING_FACE_KEY = os.getenv("HUGGING_FACE_KEY")
 CLAUDE_KEY = os.getenv("CLAUDE_KEY")
 HTTP_PROXY = os.getenv("HTTP_PROXY")
+PYANNOTE_PATH = os.getenv("PYANNOTE_PATH")
+CLAUDE_CHUNK = int(os.getenv("CLAUDE_CHUNK") or 0)
 
 
 st.set_page_config(
@@ -42,116 +43,66 @@ if "flag_start" not in st.session_state:
     st.session_state.pp_upload_list = list()
 
 
-def my_pickpod_whisper(audio_draft: AudioDraft, task_language: str = None, task_prompt: str = None, sentence_queue: Queue = None) -> None:
-    task_probability = PickpodUtils.pickpod_whisper(audio_draft, task_language, task_prompt, sentence_queue)
-    sentence_queue.put(None)
-    sentence_queue.put(task_probability)
-
-
-def my_pickpod_task(audio_draft: AudioDraft, task_config: TaskConfig):
-
-    db_sql = list()
-
-    try:
-        st.caption("2⃣️ 获取音频文件文稿", unsafe_allow_html=False)
-        start_time = time.time()
-        sentence_queue = Queue()
-        sentence_draft = list()
-        sentence_bar = st.progress(0, text="转录中，请稍后......")
-        task_thread = threading.Thread(target=my_pickpod_whisper, args=(audio_draft, task_config.language, task_config.prompt, sentence_queue, ))
-        task_thread.start()
-        while True:
-            sd: SentenceDraft = sentence_queue.get()
-            if not sd:
-                break
-            sentence_draft.append(sd)
-            sentence_bar.progress(sd.end / audio_draft.duration, text=f"已转录{round(sd.end / audio_draft.duration * 100, 2)}%，内容：（{sd.start}s -> {sd.end}s）{sd.content}")
-        task_thread.join()
-        task_config.language = task_config.language if task_config.language else audio_draft.language
-        sentence_bar.progress(1.0, text="已转录100%")
-        st.text(f"已检测到音频文件的语言为：{audio_draft.language}\n评估检测准确率为：{sentence_queue.get()}%")
-        st.info(f"ℹ️ 音频文件文稿已完成，用时：{time.time() - start_time}秒")
-
-        st.caption("3⃣️ 执行音频文件声纹分割聚类", unsafe_allow_html=False)
-        if task_config.pipeline:
-            start_time = time.time()
-            sentence_pipeline = PickpodUtils.pickpod_pyannote(audio_draft, task_config.hugging_face, task_config.path_wav)
-            st.info(f"ℹ️ 音频文件声纹分割聚类完成，用时：{time.time() - start_time}秒")
-            PickpodUtils.get_speaker_by_time(sentence_draft, sentence_pipeline)
-        else:
-            st.info(f"ℹ️ 音频文件声纹分割聚类已跳过")
-
-        claude_client = ClaudeClient(key_claude=task_config.claude, http_proxy=task_config.proxy)
-        sentence_text = " ".join([x.content for x in sentence_draft])
-        for sd in sentence_draft:
-            db_sql.append(sd.insert())
-
-        st.caption("4⃣️ 提取音频文件关键词", unsafe_allow_html=False)
-        if task_config.keyword:
-            if task_config.language == "zh":
-                audio_draft.keyword = "\n".join(claude_client.get_keyword_zh(sentence_text))
-            else:
-                audio_draft.keyword = "\n".join(claude_client.get_keyword_en(sentence_text))
-        else:
-            st.info(f"ℹ️ 提取音频文件关键词已跳过")
-        db_sql.append(audio_draft.insert())
-
-        st.caption("5⃣️ 提取音频文件文稿摘要", unsafe_allow_html=False)
-        if task_config.summary:
-            if task_config.language == "zh":
-                summary_draft = [
-                    SummaryDraft(
-                        summary_aid=audio_draft.uuid,
-                        summary_content=x[1],
-                        summary_start=x[0]
-                        )
-                    for x in claude_client.get_summary_zh(audio_draft.duration, sentence_text)
-                    ]
-            else:
-                summary_draft = [
-                    SummaryDraft(
-                        summary_aid=audio_draft.uuid,
-                        summary_content=x[1],
-                        summary_start=x[0]
-                        )
-                    for x in claude_client.get_summary_en(audio_draft.duration, sentence_text)
-                    ]
-            for sd in summary_draft:
-                db_sql.append(sd.insert())
-        else:
-            st.info(f"ℹ️ 提取音频文件文稿摘要已跳过")
-
-        st.caption("6⃣️ 提取音频文件表述观点", unsafe_allow_html=False)
-        if task_config.view:
-            if task_config.language == "zh":
-                view_draft = [
-                    ViewDraft(
-                        view_aid=audio_draft.uuid,
-                        view_content=x
-                        )
-                    for x in claude_client.get_view_zh(sentence_text)
-                    ]
-            else:
-                view_draft = [
-                    ViewDraft(
-                        view_aid=audio_draft.uuid,
-                        view_content=x
-                        )
-                    for x in claude_client.get_view_en(sentence_text)
-                    ]
-            for vd in view_draft:
-                db_sql.append(vd.insert())
-        else:
-            st.info(f"ℹ️ 提取音频文件表述观点已跳过")
+def my_pickpod_task(pickpod_task: PickpodTask) -> None:
+
+    audio_draft, task_config = pickpod_task.audio_draft, pickpod_task.task_config
+    pickpod_flow = pickpod_task.pickpod_flow(STAGE_TASK + ["persist"])
+    stage_box = dict()
+
+    st.caption("2⃣️ 获取音频文件文稿", unsafe_allow_html=False)
+    sentence_bar = st.progress(0, text="转录中，请稍后......")
+    stage_box["transcribe"] = stage_box["decode"] = st.container()
+
+    st.caption("3⃣️ 执行音频文件声纹分割聚类", unsafe_allow_html=False)
+    stage_box["diarize"] = stage_box["align"] = st.container()
+    if not task_config.pipeline:
+        stage_box["diarize"].info(f"ℹ️ 音频文件声纹分割聚类已跳过")
+
+    st.caption("4⃣️ 提取音频文件关键词", unsafe_allow_html=False)
+    stage_box["keyword"] = st.container()
+    if not task_config.keyword:
+        stage_box["keyword"].info(f"ℹ️ 提取音频文件关键词已跳过")
+
+    st.caption("5⃣️ 提取音频文件文稿摘要", unsafe_allow_html=False)
+    stage_box["summary"] = st.container()
+    if not task_config.summary:
+        stage_box["summary"].info(f"ℹ️ 提取音频文件文稿摘要已跳过")
+
+    st.caption("6⃣️ 提取音频文件表述观点", unsafe_allow_html=False)
+    stage_box["view"] = st.container()
+    if not task_config.view:
+        stage_box["view"].info(f"ℹ️ 提取音频文件表述观点已跳过")
 
-    except Exception as e:
-        st.error("语音识别处理失败，错误码：{}，错误信息：{}。".format(e.args[0], e.args[-1]))
+    for stage_name, stage_state, stage_payload in pickpod_flow.stream():
 
-    finally:
-        db_client = DBClient(task_config.path_db)
-        for x, y in db_sql:
-            db_client.execute(x, y)
-        db_client.close()
+        if stage_state == "partial" and stage_name == "transcribe":
+            sd: SentenceDraft = stage_payload
+            sentence_bar.progress(min(sd.end / audio_draft.duration, 1.0), text=f"已转录{round(sd.end / audio_draft.duration * 100, 2)}%，内容：（{sd.start}s -> {sd.end}s）{sd.content}")
+
+        elif stage_state == "done" and stage_name == "transcribe":
+            sentence_bar.progress(1.0, text="已转录100%")
+            stage_box[stage_name].text(f"已检测到音频文件的语言为：{audio_draft.language}\n评估检测准确率为：{stage_payload}%")
+            stage_box[stage_name].info(f"ℹ️ 音频文件文稿已完成，用时：{pickpod_flow.timing[stage_name]}秒")
+
+        elif stage_state == "partial" and stage_name == "summary":
+            sd: SummaryDraft = stage_payload
+            stage_box[stage_name].text(f"{s2t(sd.start)} - {sd.content}")
+
+        elif stage_state == "partial" and stage_name == "view":
+            vd: ViewDraft = stage_payload
+            stage_box[stage_name].text(f"· {vd.content}")
+
+        elif stage_state == "done" and stage_name == "diarize":
+            stage_box[stage_name].info(f"ℹ️ 音频文件声纹分割聚类完成，用时：{pickpod_flow.timing[stage_name]}秒")
+
+        elif stage_state == "done" and stage_name in ("keyword", "summary", "view"):
+            stage_box[stage_name].info(f"ℹ️ 已完成，用时：{pickpod_flow.timing[stage_name]}秒")
+
+        elif stage_state == "fail":
+            e = stage_payload
+            stage_box.get(stage_name, st).error("语音识别处理失败，错误码：{}，错误信息：{}。".format(e.args[0], e.args[-1]))
+
+    pickpod_task.audio_buffer = None
 
 
 def run():
@@ -218,10 +169,15 @@ def run():
             key_hugging_face=HUGGING_FACE_KEY,
             key_claude=CLAUDE_KEY,
             path_wav=os.path.join(DATA_PATH, "wav"),
+            path_audio=os.path.join(DATA_PATH, "audio"),
             path_db=DATA_PATH,
+            path_pyannote=PYANNOTE_PATH,
             task_language=pp_language,
             task_prompt=pp_prompt,
             task_proxy=HTTP_PROXY,
+            claude_cache=True,
+            claude_chunk=CLAUDE_CHUNK,
+            claude_stream=True,
             pipeline=pp_pipeline,
             keyword=pp_keyword,
             summary=pp_summary,
@@ -234,22 +190,22 @@ def run():
 
         elif pp_origin and len(st.session_state.pp_url_list) > 0:
 
-            for web_url in st.session_state.pp_url_list:
+            pickpod_batch = PickpodBatch([
+                PickpodTask(AudioDraft(audio_web=web_url, audio_url=web_url, audio_origin="网络"), task_config)
+                for web_url in st.session_state.pp_url_list
+                ])
 
-                with st.expander(f"任务链接：{web_url}"):
+            for pickpod_task, download_error in pickpod_batch.download_iter():
+
+                with st.expander(f"任务链接：{pickpod_task.audio_draft.web}"):
                     st.caption("1⃣️ 存储音频文件到本地", unsafe_allow_html=False)
-                    start_time = time.time()
-                    audio_draft = AudioDraft(audio_web=web_url, audio_url=web_url, audio_origin="网络")
-                    if task_config.proxy:
-                        YDL_OPTION["proxy"] = task_config.proxy
-                    YDL_OPTION["outtmpl"] = f"{DATA_PATH}/audio/{audio_draft.uuid}.%(ext)s"
-                    try:
-                        PickpodUtils.pickpod_ytdlp(audio_draft, YDL_OPTION)
-                        st.info(f"ℹ️ 音频文件下载完成，用时：{time.time() - start_time} 秒")
-                    except Exception as e:
+                    if download_error:
+                        e = download_error
                         st.error("音频文件下载失败，已跳过。错误码：{}，错误信息：{}。".format(e.args[0], e.args[-1]))
+                        continue
+                    st.info(f"ℹ️ 音频文件下载完成，用时：{pickpod_batch.timing[pickpod_task.audio_draft.uuid]} 秒")
 
-                    my_pickpod_task(audio_draft, task_config)
+                    my_pickpod_task(pickpod_task)
 
             PickpodUtils.static_clean()
             st.success("所有音频已转录完成，您可以前往“Gallery”页查看", icon="✅")
@@ -267,10 +223,10 @@ def run():
                     audio_draft.path = f"{DATA_PATH}/audio/{audio_draft.uuid}.{audio_draft.ext}"
                     with open(audio_draft.path, "wb") as f:
                         f.write(upload_file[1])
-                    audio_draft.duration = len(AudioSegment.from_file(audio_draft.path)) / 1000
+                    audio_draft.duration = PickpodUtils.get_duration(audio_draft.path)
                     st.info(f"ℹ️ 音频文件下载完成，用时：{time.time() - start_time} 秒")
 
-                    my_pickpod_task(audio_draft, task_config)
+                    my_pickpod_task(PickpodTask(audio_draft, task_config))
 
             PickpodUtils.static_clean()
             st.success("所有音频已转录完成，您可以前往“Gallery”页查看", icon="✅")
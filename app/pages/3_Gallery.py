@@ -6,17 +6,19 @@ import os
 from datetime import datetime
 
 import streamlit as st
-from Home import DATA_PATH, index, wiki_gallery
+from Home import DATA_PATH, get_media_server, get_media_url, index, wiki_gallery
 
 from pickpod.api import s2t
-from pickpod.config import DBClient, TaskConfig
+from pickpod.config import DBCache, DBClient, DBUnit, TaskConfig
 from pickpod.draft import AudioDraft, SentenceDraft, SummaryDraft, ViewDraft, WikiDraft
 from pickpod.task import PickpodTask
 
 
 os.chdir(os.path.split(os.path.realpath(__file__))[0])
 
-PPDB = DBClient(DATA_PATH)
+PPDB = DBClient(DATA_PATH, db_cache=DBCache())
+PPMEDIA = get_media_server()
+MEDIA_URL = get_media_url()
 
 
 st.set_page_config(
@@ -49,9 +51,10 @@ if df_name:
     pickpod_task.summary_draft = [SummaryDraft.db_init(sd) for sd in [
         PPDB.fetchall(x, y) for x, y in [SummaryDraft.select_by_aid(audio_draft.uuid)]
         ][0]]
-    pickpod_task.view_draft = [ViewDraft.db_init(sd) for sd in [
+    db_unit = DBUnit(PPDB)
+    pickpod_task.view_draft = db_unit.register([ViewDraft.db_init(sd) for sd in [
         PPDB.fetchall(x, y) for x, y in [ViewDraft.select_by_aid(audio_draft.uuid)]
-        ][0]]
+        ][0]])
 
 with st.sidebar:
 
@@ -68,48 +71,55 @@ with st.sidebar:
 
     gallery_list = dict()
 
+    pp_hit = list()
+
     if st.session_state.pp_search:
 
         st.header("结果 Pickpod")
 
         pp_range = [x[1] for x in pp_range] if len(pp_range) > 0 else ["title", "description", "keyword", "sentence"]
 
-        if pp_q:
+        pp_time = (
+            datetime(pp_date[0].year, pp_date[0].month, pp_date[0].day).timestamp(),
+            datetime(pp_date[1].year, pp_date[1].month, pp_date[1].day).timestamp() + 24 * 3600
+            )
+
+        if pp_q and len(pp_q) >= 3 and PPDB.has_fts():
+
+            # 三字及以上的关键词使用全文索引，按相关度排序
+            pp_audio = list()
+
+            if set(pp_range) & {"title", "description", "keyword"}:
+                pp_audio.extend(PPDB.fetchall(*AudioDraft.search_uuid(pp_q, [x for x in pp_range if x != "sentence"], *pp_time)))
+
+            if "sentence" in pp_range:
+                pp_audio.extend(PPDB.fetchall(*AudioDraft.search_sentence_uuid(pp_q, *pp_time)))
+                pp_hit = PPDB.fetchall(*SentenceDraft.search_by_content(pp_q, *pp_time))
+
+            pp_audio = sorted(set(pp_audio), key=pp_audio.index)
+
+        elif pp_q:
 
+            # 过短的关键词无法使用三元组索引，退回逐字匹配
             pp_audio = list()
 
             if "title" in pp_range:
-                pp_audio.extend([PPDB.fetchall(x, y) for x, y in [AudioDraft.select_title_uuid(
-                    pp_q,
-                    datetime(pp_date[0].year, pp_date[0].month, pp_date[0].day).timestamp(),
-                    datetime(pp_date[1].year, pp_date[1].month, pp_date[1].day).timestamp() + 24 * 3600
-                )]][0])
+                pp_audio.extend(PPDB.fetchall(*AudioDraft.select_title_uuid(pp_q, *pp_time)))
 
             if "description" in pp_range:
-                pp_audio.extend([PPDB.fetchall(x, y) for x, y in [AudioDraft.select_description_uuid(
-                    pp_q,
-                    datetime(pp_date[0].year, pp_date[0].month, pp_date[0].day).timestamp(),
-                    datetime(pp_date[1].year, pp_date[1].month, pp_date[1].day).timestamp() + 24 * 3600
-                )]][0])
+                pp_audio.extend(PPDB.fetchall(*AudioDraft.select_description_uuid(pp_q, *pp_time)))
 
             if "keyword" in pp_range:
-                pp_audio.extend([PPDB.fetchall(x, y) for x, y in [AudioDraft.select_keyword_uuid(
-                    pp_q,
-                    datetime(pp_date[0].year, pp_date[0].month, pp_date[0].day).timestamp(),
-                    datetime(pp_date[1].year, pp_date[1].month, pp_date[1].day).timestamp() + 24 * 3600
-                )]][0])
+                pp_audio.extend(PPDB.fetchall(*AudioDraft.select_keyword_uuid(pp_q, *pp_time)))
 
             if "sentence" in pp_range:
-                pp_audio.extend([[
-                    PPDB.fetchone(u, v) for u, v in [AudioDraft.select_sentence_uuid(
-                        z[0],
-                        datetime(pp_date[0].year, pp_date[0].month, pp_date[0].day).timestamp(),
-                        datetime(pp_date[1].year, pp_date[1].month, pp_date[1].day).timestamp() + 24 * 3600
-                        )]
-                    ][0] for z in [PPDB.fetchall(x, y) for x, y in [SentenceDraft.select_by_content(pp_q)]][0]
+                pp_audio.extend([
+                    (x.uuid, x.origin, x.ctime) for x in AudioDraft.group_by_uuid(PPDB.fetchall_chunk(AudioDraft.select_by_uuids([
+                        z[0] for z in PPDB.fetchall(*SentenceDraft.select_by_content(pp_q))
+                        ]))).values() if pp_time[0] <= x.ctime < pp_time[1]
                     ])
 
-            pp_audio = sorted(set(pp_audio), key=lambda x: x[2], reverse=True)
+            pp_audio = sorted(set([x for x in pp_audio if x]), key=lambda x: x[2], reverse=True)
 
         else:
 
@@ -121,6 +131,19 @@ with st.sidebar:
 
         pp_audio = PPDB.fetchall(AudioDraft.select_all_uuid())
 
+    if pp_hit:
+
+        with st.expander(f"正文命中{len(pp_hit)}处"):
+            hit_select = st.radio(
+                "正文命中",
+                pp_hit,
+                format_func=lambda x: x[4],
+                captions=[f"{x[1]}（{s2t(x[3])}）" for x in pp_hit],
+                label_visibility="collapsed"
+                )
+            st.audio(PPMEDIA.get_clip_url(MEDIA_URL, hit_select[0], hit_select[3], hit_select[3] + 30), format="audio/mpeg")
+            st.button("从该处播放", on_click=lambda x: exec("st.query_params.uuid = x[0]\nst.session_state.pp_start = int(x[3])\nst.session_state.pp_set = True"), kwargs=dict(x=hit_select), use_container_width=True)
+
     for audio_uuid, audio_origin, audio_ctime in pp_audio:
 
         audio_stamp = datetime.fromtimestamp(audio_ctime)
@@ -131,6 +154,8 @@ with st.sidebar:
 
         gallery_list[audio_time][audio_origin].append(audio_uuid)
 
+    gallery_draft = AudioDraft.group_by_uuid(PPDB.fetchall_chunk(AudioDraft.select_by_uuids([x[0] for x in pp_audio])))
+
     for audio_time, audio_dict in gallery_list.items():
 
         with st.expander(audio_time):
@@ -138,13 +163,9 @@ with st.sidebar:
             audio_params = st.radio(
                 "Pickpod 文稿",
                 audio_dict[audio_origin],
-                format_func=lambda z: [AudioDraft.db_init(PPDB.fetchone(x, y)) for x, y in [AudioDraft.select_by_uuid(z)]][0].title,
+                format_func=lambda z: gallery_draft[z].title,
                 key=f"{audio_time}_radio",
-                captions=["; ".join(ad.keyword.split("\n")) for ad in [
-                    AudioDraft.db_init(PPDB.fetchone(x, y)) for x, y in [
-                        AudioDraft.select_by_uuid(z) for z in audio_dict[audio_origin]
-                        ]
-                    ]],
+                captions=["; ".join(gallery_draft[z].keyword.split("\n")) for z in audio_dict[audio_origin]],
                 label_visibility="collapsed"
                 )
             st.button("前往", key=f"{audio_time}_button", on_click=lambda x: exec("st.query_params.uuid = x if x else str()"), kwargs=dict(x=audio_params), use_container_width=True)
@@ -172,17 +193,14 @@ if df_name:
 
     st.markdown(f"##### {audio_draft.title}")
 
-    with open(audio_draft.path, "rb") as f:
-        audio_bytes = f.read()
-
-    st.audio(audio_bytes, format=f"audio/mp4", start_time=st.session_state.pp_start)
+    st.audio(PPMEDIA.get_audio_url(MEDIA_URL, audio_draft.uuid), format=f"audio/mp4", start_time=st.session_state.pp_start)
     st.session_state.pp_start = 0
     st.session_state.pp_set = False
 
     col_download, col_web = st.columns([1, 1])
 
     with col_download:
-        st.download_button("导出音频", audio_bytes, f"{pickpod_task.audio_safe_name()}.{audio_draft.ext}", help="下载以标题命名的音频文件", use_container_width=True)
+        st.link_button("导出音频", PPMEDIA.get_audio_url(MEDIA_URL, audio_draft.uuid, f"{pickpod_task.audio_safe_name()}.{audio_draft.ext}"), help="下载以标题命名的音频文件", use_container_width=True)
 
     with col_web:
         st.link_button("前往原始链接", audio_draft.web, help="查看原始网页", disabled=False if audio_draft.web else True, use_container_width=True)
@@ -210,16 +228,11 @@ if df_name:
 
         wiki_save = st.button("保存到知识库", "已勾选的指定观点表述将被保存到您的知识库集合", use_container_width=True)
         if wiki_save:
-            for x, y in [
-                WikiDraft(
-                    wiki_aid=vd.aid, wiki_content=vd.content, wiki_value=vd.value
-                    ).insert() for i, vd in enumerate(pickpod_task.view_draft) if wiki_add[i]
-                ]:
-                PPDB.execute(x, y)
+            for vd in [vd for i, vd in enumerate(pickpod_task.view_draft) if wiki_add[i]]:
+                db_unit.add(WikiDraft(wiki_aid=vd.aid, wiki_content=vd.content, wiki_value=vd.value))
             st.success("您勾选的观点已被保存到知识库集合。", icon="✅")
 
-        for x, y in [z.update() for z in pickpod_task.view_draft]:
-            PPDB.execute(x, y)
+        db_unit.flush()
 
         col_duration, col_ext = st.columns([1, 1])
         with col_duration:
@@ -4,16 +4,18 @@
 import os
 
 import streamlit as st
-from Home import DATA_PATH
+from Home import DATA_PATH, get_media_server, get_media_url
 
 from pickpod.api import s2t
-from pickpod.config import DBClient
+from pickpod.config import DBCache, DBClient, DBUnit
 from pickpod.draft import AudioDraft, SentenceDraft, SummaryDraft, ViewDraft
 
 
 os.chdir(os.path.split(os.path.realpath(__file__))[0])
 
-PPDB = DBClient(DATA_PATH)
+PPDB = DBClient(DATA_PATH, db_cache=DBCache())
+PPMEDIA = get_media_server()
+MEDIA_URL = get_media_url()
 
 
 st.set_page_config(
@@ -38,11 +40,12 @@ df_name = st.query_params.to_dict().get("uuid")
 
 if df_name:
 
-    audio_draft: AudioDraft = AudioDraft.db_init([PPDB.fetchone(x, y) for x, y in [
-        AudioDraft.select_by_uuid(df_name)
-        ]][0])
+    # 仅保存本次编辑中被修改的条目
+    db_unit = DBUnit(PPDB)
 
-    db_sql = list()
+    audio_draft: AudioDraft = db_unit.register([AudioDraft.db_init([PPDB.fetchone(x, y) for x, y in [
+        AudioDraft.select_by_uuid(df_name)
+        ]][0])])[0]
 
     if pp_audio == 0:
 
@@ -56,26 +59,42 @@ if df_name:
 
         audio_draft.keyword = st.text_area("关键词", audio_draft.keyword, 260, placeholder="请编辑该音频的关键词")
 
-        audio_draft.origin = st.selectbox("来源", ["定时", "网络", "本地"], help="请选择 Pickpod 任务的来源")
+        audio_origin = ["定时", "网络", "本地"]
+        audio_draft.origin = st.selectbox("来源", audio_origin, audio_origin.index(audio_draft.origin) if audio_draft.origin in audio_origin else 0, help="请选择 Pickpod 任务的来源")
 
         if st.button("删除该任务", help="将该任务从 Pickpod 库中删除，若出现页面错误，请前往“Home”页以重新开始", use_container_width=True):
             x, y = AudioDraft.delete_status(audio_draft.uuid)
             PPDB.execute(x, y)
             st.success(f"Pickpod 任务：{audio_draft.uuid}已从数据库中删除，请关闭此页面。", icon="✅")
-        else:
-            db_sql.append(audio_draft.update())
 
     elif pp_audio == 1:
 
-        with open(audio_draft.path, "rb") as f:
-            audio_bytes = f.read()
+        with st.sidebar:
+            pp_size = st.selectbox("每页文稿数", [20, 50, 100], 1, help="文稿按起始时间分页加载，每次仅渲染一页")
 
-        st.audio(audio_bytes, format=f"audio/mp4", start_time=0)
+        # 按 (start, uuid) 键集分页，页面渲染耗时与音频长度无关
+        if "pp_cursor" not in st.session_state:
+            st.session_state.pp_cursor = dict()
+        page_start, page_uuid = st.session_state.pp_cursor.get(audio_draft.uuid, (-1.0, ""))
 
-        sentence_draft = [SentenceDraft.db_init(sd) for sd in [
-            PPDB.fetchall(x, y) for x, y in [SentenceDraft.select_by_aid(audio_draft.uuid)]
+        sentence_page = [SentenceDraft.db_init(sd) for sd in [
+            PPDB.fetchall(x, y) for x, y in [SentenceDraft.select_page(audio_draft.uuid, page_start, page_uuid, pp_size)]
+            ][0]]
+        sentence_draft = db_unit.register(sentence_page[:pp_size])
+
+        st.audio(PPMEDIA.get_audio_url(MEDIA_URL, audio_draft.uuid), format=f"audio/mp4", start_time=int(sentence_draft[0].start) if sentence_draft else 0)
+        sentence_next = sentence_page[pp_size] if len(sentence_page) > pp_size else None
+        sentence_prev = [SentenceDraft.db_init(sd) for sd in [
+            PPDB.fetchall(x, y) for x, y in [SentenceDraft.select_page_before(audio_draft.uuid, *(
+                (sentence_draft[0].start, sentence_draft[0].uuid) if sentence_draft else (page_start, page_uuid)
+                ), pp_size)]
             ][0]]
 
+        if sentence_draft:
+            st.caption(f"当前页：{s2t(sentence_draft[0].start)} - {s2t(sentence_draft[-1].end)}")
+        else:
+            st.info("ℹ️ 该页暂无文稿，请返回上一页或跳转到其他时间")
+
         for sd in sentence_draft:
 
             sd.content = st.text_input("文稿内容", sd.content, key=f"text_{sd.uuid}", placeholder="请编辑该时间范围内音频的文稿内容")
@@ -92,22 +111,42 @@ if df_name:
                 x, y = SentenceDraft.delete_status(sd.uuid)
                 PPDB.execute(x, y)
                 st.success(f"Pickpod 文稿：{sd.uuid}已从数据库中删除。", icon="✅")
-            else:
-                db_sql.append(sd.update())
+
+        with st.sidebar:
+
+            pp_jump = st.number_input("跳转到时间（秒）", 0.0, max(audio_draft.duration, page_start, 0.0), max(page_start, 0.0), 1.0, help="从该时间之后的第一段文稿开始显示")
+
+            col_jump, col_prev, col_next = st.columns([1, 1, 1])
+            with col_jump:
+                page_jump = st.button("跳转", help="切换页面前将保存本页的修改", use_container_width=True)
+            with col_prev:
+                page_prev = st.button("上一页", help="切换页面前将保存本页的修改", disabled=not sentence_prev, use_container_width=True)
+            with col_next:
+                page_next = st.button("下一页", help="切换页面前将保存本页的修改", disabled=sentence_next is None, use_container_width=True)
+
+            if page_jump or page_prev or page_next:
+                db_unit.flush()
+                if page_jump:
+                    st.session_state.pp_cursor[audio_draft.uuid] = (pp_jump, "")
+                elif page_prev:
+                    st.session_state.pp_cursor[audio_draft.uuid] = (sentence_prev[-1].start, sentence_prev[-1].uuid)
+                else:
+                    st.session_state.pp_cursor[audio_draft.uuid] = (sentence_next.start, sentence_next.uuid)
+                st.rerun()
 
     elif pp_audio == 2:
 
-        summary_draft = [SummaryDraft.db_init(sd) for sd in [
+        summary_draft = db_unit.register([SummaryDraft.db_init(sd) for sd in [
             PPDB.fetchall(x, y) for x, y in [SummaryDraft.select_by_aid(audio_draft.uuid)]
-            ][0]]
+            ][0]])
 
         with st.form("添加摘要", True):
             summary_content = st.text_input("添加摘要", help="您可以直接在此处为该 Pickpod 任务新增一条摘要", placeholder="请在此处输入新增摘要的内容")
             summary_start = st.number_input("时间节点", 0.0, audio_draft.duration, 0.0, 0.01, help="请标记与该条摘要相关的音频时间节点，此处涉及一定换算", placeholder="请在此处输入新增摘要在对应音频中的位置")
             summary_submit = st.form_submit_button("添加到 Pickpod 库", "该 Pickpod 任务下将新增一条音频文稿摘要", use_container_width=True)
             if summary_submit:
-                x, y = SummaryDraft(summary_aid=audio_draft.uuid, summary_content=summary_content, summary_start=summary_start).insert()
-                PPDB.execute(x, y)
+                db_unit.add(SummaryDraft(summary_aid=audio_draft.uuid, summary_content=summary_content, summary_start=summary_start))
+                db_unit.flush()
                 st.rerun()
 
         for sd in summary_draft:
@@ -120,22 +159,20 @@ if df_name:
                 x, y = SummaryDraft.delete_status(sd.uuid)
                 PPDB.execute(x, y)
                 st.success(f"Pickpod 摘要：{sd.uuid}已从数据库中删除。", icon="✅")
-            else:
-                db_sql.append(sd.update())
 
     elif pp_audio == 3:
 
-        view_draft = [ViewDraft.db_init(sd) for sd in [
+        view_draft = db_unit.register([ViewDraft.db_init(sd) for sd in [
             PPDB.fetchall(x, y) for x, y in [ViewDraft.select_by_aid(audio_draft.uuid)]
-            ][0]]
+            ][0]])
 
         with st.form("添加观点表述", True):
             view_content = st.text_input("添加观点表述", help="您可以直接在此处为该 Pickpod 任务新增一条观点表述", placeholder="请在此处输入新增观点的内容，并在下方评价其对您的价值")
             view_value = st.toggle("是否有效", True)
             view_submit = st.form_submit_button("添加到 Pickpod 库", "该 Pickpod 任务下将新增一条观点表述", use_container_width=True)
             if view_submit:
-                x, y = ViewDraft(view_aid=audio_draft.uuid, view_content=view_content, view_value=view_value).insert()
-                PPDB.execute(x, y)
+                db_unit.add(ViewDraft(view_aid=audio_draft.uuid, view_content=view_content, view_value=view_value))
+                db_unit.flush()
                 st.rerun()
 
         for vd in view_draft:
@@ -148,13 +185,10 @@ if df_name:
                 x, y = ViewDraft.delete_status(vd.uuid)
                 PPDB.execute(x, y)
                 st.success(f"Pickpod 观点表述：{vd.uuid}已从数据库中删除。", icon="✅")
-            else:
-                db_sql.append(vd.update())
 
     if st.button("保存更新", help="您修改的内容将在 Pickpod 库中生效", use_container_width=True):
-        for x, y in db_sql:
-            PPDB.execute(x, y)
-        st.success(f"Pickpod 任务：{audio_draft.uuid}已在数据库中更新", icon="✅")
+        db_count = db_unit.flush()
+        st.success(f"Pickpod 任务：{audio_draft.uuid}已在数据库中更新（{db_count} 条修改）", icon="✅")
 
 else:
 
@@ -1,11 +1,25 @@
 # !/usr/bin/env python3.8
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import os
+import random
 import re
-from typing import Dict, List
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from pickpod.draft import SummaryDraft, ViewDraft
+
+
+# HTTP status codes of Claude responses worth retrying
+RETRY_STATUS = (408, 429, 500, 502, 503, 504, 529)
 
 PROMPT_KEYWORD_ZH = "Human:你的任务是对下面的文本提取不超过10个关键词，每个关键词都应简明扼要，不能重复，且必须用中文输出，文本如下：\"{}\"\n\nAssistant:"
 PROMPT_KEYWORD_EN = "Human:Your task is to extract no more than 10 keywords from the received text. Each keyword should be concise and non-repetitive. The text is as follows: \"{}\"\n\nAssistant:"
@@ -13,6 +27,12 @@ PROMPT_SUMMARY_ZH = "Human:从音频文本中创建不超过30个关键时刻，
 PROMPT_SUMMARY_EN = "Human:Create no more than 30 key moments from the audio text, including the time. Your answer should be concise and start with 00:00:00, end with {}. Your answer must be translated into English.\n\nAssistant:Sure, I konw the rule. I'll create key moments from the recived text including the time in English.\n\nHuman:TEXT: \"Hello everyone, this is phase 5 of the Ladder Project. We created the Ladder Project as a platform for sincere discussion and in-depth analysis of key issues in the crypto ecosystem. By the way, I'm Frank Lee, a DeFi and smart contract security practitioner.\"\n\nAssistant:00:00:00 - Introducing the Program\n\nHuman:TEXT: \"{}\"\n\nAssistant:"
 PROMPT_VIEW_ZH = "Human:用中文回答文中有哪些反常识或者有尖锐态度的新观点？请输出7到8个，并说明和常识不一致的具体原因。\n\nAssistant:好的，我明白要求和输出的格式了，请给我具体的文字。\n\nHuman:文本：\"{}\"\n\nAssistant:"
 PROMPT_VIEW_EN = "Human:What unconventional or sharp attitudes are there in the following transcript? List the five most important ones and explain why they contradict the consensus. The language you respond in must be consistent with the language of the transcript. The text is as follows: \"{}\"\n\nAssistant:"
+PROMPT_SUMMARY_CHUNK_ZH = "Human:下面是一段音频文本的片段，每句话前的方括号中标注了它在完整音频中的起始时间。请从中创建不超过{}个关键时刻，每个关键时刻单独一行，格式为“时:分:秒 - 内容”，时间必须取自文本中标注的时间，不早于{}且不晚于{}。您的答案应简明，且必须翻译成简体中文。文本：\"{}\"\n\nAssistant:"
+PROMPT_SUMMARY_CHUNK_EN = "Human:Below is a part of an audio transcript, and each sentence is prefixed with its start time in the whole audio in square brackets. Create no more than {} key moments from it, one per line in the format \"HH:MM:SS - content\". The time must be taken from the marked times, no earlier than {} and no later than {}. Your answer should be concise and must be translated into English. TEXT: \"{}\"\n\nAssistant:"
+PROMPT_VIEW_MERGE_ZH = "Human:以下是从同一段音频的不同片段中分别提取的反常识或有尖锐态度的观点，请合并重复的观点，并用中文输出其中最重要的7到8个，每个观点单独一行，并说明和常识不一致的具体原因。观点如下：\"{}\"\n\nAssistant:"
+PROMPT_VIEW_MERGE_EN = "Human:Below are unconventional or sharp attitudes extracted separately from different parts of the same transcript. Merge the duplicated ones and list the five most important ones, one per line, explaining why they contradict the consensus. The language you respond in must be consistent with the views. The views are as follows: \"{}\"\n\nAssistant:"
+PROMPT_COMBINE_ZH = "Human:请阅读下面的音频文本，并用简体中文一次性完成三项任务：1. 提取不超过10个关键词，每个关键词都应简明扼要，不能重复，用逗号分隔，放在<keyword></keyword>标签中；2. 创建不超过30个包括时间的关键时刻，每行格式为“时:分:秒 - 内容”，以00:00:00开头，以{}结尾，放在<summary></summary>标签中；3. 列出7到8个文中反常识或者有尖锐态度的新观点，每行一个，并说明和常识不一致的具体原因，放在<view></view>标签中。文本：\"{}\"\n\nAssistant:"
+PROMPT_COMBINE_EN = "Human:Read the following audio transcript and complete three tasks at once in English: 1. Extract no more than 10 concise and non-repetitive keywords, separated by commas, inside <keyword></keyword> tags; 2. Create no more than 30 key moments including the time, one per line in the format \"HH:MM:SS - content\", starting with 00:00:00 and ending with {}, inside <summary></summary> tags; 3. List the five most important unconventional or sharp attitudes in the transcript, one per line, explaining why they contradict the consensus, inside <view></view> tags. The text is as follows: \"{}\"\n\nAssistant:"
 PROMPT_RECOMMEND_NONE = "Human:请对以下{}段不同的音频文本进行排序。对于表达的观点越新颖、尖锐、反常识的音频文本，它的排序结果应当越靠前，我越有可能收听。你可以直接输出一串代表推荐顺序的阿拉伯数字，不用附加额外说明。\n\nAssistant:好的，我明白要求和输出的格式了，请给我具体的文字。\n\nHuman:音频文本：\"{}\"\n\nAssistant:"
 PROMPT_RECOMMEND_WIKI = "Human:请对以下{}段不同的音频文本进行排序，我将分别提供一系列我感兴趣和不感兴趣的观点由于参考。对于表达的观点符合我的情趣，且越新颖、尖锐、反常识的音频文本，它的排序结果应当越靠前，我越有可能收听；反之对于表达的观点令我不感兴趣，或平庸并已经成为常识的音频文本，它的排序应当靠后，我不会收听。你可以直接输出一串代表推荐顺序的阿拉伯数字，不用附加额外说明。\n\nAssistant:好的，我明白要求和输出的格式了，请给我具体的文字。\n\nHuman:我感兴趣的观点：\"{}\"\n\n我不感兴趣的观点：\"{}\"\n\n音频文本：\"{}\"\n\nAssistant:"
 
@@ -26,11 +46,166 @@ def s2t(t: float = 0.0) -> str:
     h, m = divmod(m, 60)
     return "%02d:%02d:%02d" % (h, m, s)
 
+def parse_keyword(claude_keyword: str = "") -> List[str]:
+    return [y.strip() for x in [
+        re.sub("^\d*\.\s|^\d*\.|^-\s|^-|^\s*|\s$", "", x).split(",")
+        for x in claude_keyword.split("\n\n")[1].split("\n")
+        ] for y in x]
+
+def parse_summary(claude_summary: str = "") -> List[tuple]:
+    return [
+        (t2s(re.match("^\s*\d\d:\d\d:\d\d", x).group()), re.sub("^\s*\d\d:\d\d:\d\d\s*-\s*", "", x).strip())
+        for x in claude_summary.split("\n")
+        if x and re.match("^\s*\d\d:\d\d:\d\d", x)
+    ]
+
+def parse_view(claude_view: str = "") -> List[str]:
+    return [
+        re.sub("^\d*\.\s|^\d*\.|^-\s|^-|^\s*|\s$", "", x).strip()
+        for x in claude_view.split("\n")
+        if x
+    ]
+
+def parse_combine(claude_combine: str = "") -> Dict[str, list]:
+    combine_dict = {x: (re.search(f"<{x}>(.*?)</{x}>", claude_combine, re.S) or re.search(f"<{x}>(.*)", claude_combine, re.S)) for x in ("keyword", "summary", "view")}
+    combine_dict = {x: y.group(1).strip() if y else "" for x, y in combine_dict.items()}
+    return {
+        "keyword": [y.strip() for x in [
+            re.sub("^\d*\.\s|^\d*\.|^-\s|^-|^\s*|\s$", "", x)
+            for x in combine_dict["keyword"].split("\n")
+            ] for y in re.split(",|，|、", x) if y.strip()],
+        "summary": parse_summary(combine_dict["summary"]),
+        "view": parse_view(combine_dict["view"])
+    }
+
+
+class ClaudeCache(object):
+    """
+    Persistent content-addressed cache of Claude completions stored in SQLite.
+    Entries expire after ttl seconds, and the least recently used ones are evicted beyond max_byte.
+    Use get_cache to share one instance and its connection per database file.
+    """
+
+    cache_dict = dict()
+    cache_lock = threading.Lock()
+
+    def __init__(self, path_db: str = "", name_db: str = "claude.db", ttl: int = 30 * 24 * 3600, max_byte: int = 256 * 1024 * 1024) -> None:
+        self.path = os.path.join(path_db, name_db)
+        self.ttl = ttl
+        self.max_byte = max_byte
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.conn as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS completion (key text PRIMARY KEY, completion text NOT NULL, size integer NOT NULL, createTime integer NOT NULL, accessTime integer NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS completion_access ON completion (accessTime)")
+
+    @classmethod
+    def get_cache(cls, path_db: str = "", name_db: str = "claude.db") -> object:
+        """
+        Get the cache of a database file, creating it if necessary
+        """
+        path_file = os.path.abspath(os.path.join(path_db, name_db))
+        with cls.cache_lock:
+            if path_file not in cls.cache_dict:
+                cls.cache_dict[path_file] = ClaudeCache(os.path.dirname(path_file), os.path.basename(path_file))
+            return cls.cache_dict[path_file]
+
+    @staticmethod
+    def get_key(body: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, body: Dict[str, Any]) -> str:
+        cache_key, cache_time = self.get_key(body), int(time.time())
+        with self.lock, self.conn as conn:
+            cache_row = conn.execute("SELECT completion, createTime FROM completion WHERE key=?", (cache_key, )).fetchone()
+            if cache_row is None:
+                return None
+            if cache_row[1] + self.ttl < cache_time:
+                conn.execute("DELETE FROM completion WHERE key=?", (cache_key, ))
+                return None
+            conn.execute("UPDATE completion SET accessTime=? WHERE key=?", (cache_time, cache_key))
+            return cache_row[0]
+
+    def put(self, body: Dict[str, Any], completion: str = "") -> None:
+        cache_key, cache_time = self.get_key(body), int(time.time())
+        with self.lock, self.conn as conn:
+            conn.execute("INSERT OR REPLACE INTO completion (key, completion, size, createTime, accessTime) VALUES (?, ?, ?, ?, ?)", (cache_key, completion, len(completion.encode("utf-8")), cache_time, cache_time))
+            conn.execute("DELETE FROM completion WHERE createTime<?", (cache_time - self.ttl, ))
+            cache_size = conn.execute("SELECT coalesce(sum(size), 0) FROM completion").fetchone()[0]
+            if cache_size <= self.max_byte:
+                return
+            cache_evict = list()
+            for x, y in conn.execute("SELECT key, size FROM completion ORDER BY accessTime ASC"):
+                if cache_size <= self.max_byte:
+                    break
+                cache_evict.append((x, ))
+                cache_size -= y
+            conn.executemany("DELETE FROM completion WHERE key=?", cache_evict)
+
+    def clear(self) -> None:
+        with self.lock, self.conn as conn:
+            conn.execute("DELETE FROM completion")
+
+    def close(self) -> None:
+        with ClaudeCache.cache_lock:
+            if ClaudeCache.cache_dict.get(os.path.abspath(self.path)) is self:
+                del ClaudeCache.cache_dict[os.path.abspath(self.path)]
+        with self.lock:
+            self.conn.close()
+
+
+class ClaudeLimiter(object):
+    """
+    Process-wide token bucket and concurrency cap shared by all Claude requests.
+    A Retry-After from the server pauses every request of the process.
+    """
+
+    rate = 1.0 # Requests per second
+    burst = 5 # Bucket size
+    token = 5.0
+    stamp = time.monotonic()
+    resume = 0.0
+    lock = threading.Lock()
+    semaphore = threading.BoundedSemaphore(4)
+
+    @classmethod
+    def configure(cls, rate: float = 1.0, burst: int = 5, max_concurrency: int = 4) -> None:
+        with cls.lock:
+            cls.rate, cls.burst, cls.token = rate, burst, float(burst)
+            cls.semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    @classmethod
+    def acquire(cls) -> None:
+        """
+        Wait for a token
+        """
+        while True:
+            with cls.lock:
+                limiter_time = time.monotonic()
+                cls.token = min(cls.burst, cls.token + (limiter_time - cls.stamp) * cls.rate)
+                cls.stamp = limiter_time
+                if limiter_time >= cls.resume and cls.token >= 1:
+                    cls.token -= 1
+                    return
+                limiter_wait = max(cls.resume - limiter_time, (1 - cls.token) / cls.rate)
+            time.sleep(limiter_wait)
+
+    @classmethod
+    def pause(cls, delay: float = 0.0) -> None:
+        """
+        Hold every request for delay seconds
+        """
+        with cls.lock:
+            cls.resume = max(cls.resume, time.monotonic() + delay)
+
 
 class ClaudeClient(object):
 
-    def __init__(self, key_claude: str = "", http_proxy: str = None) -> None:
-        self.url = "https://api.anthropic.com/v1/complete"
+    session = None
+    session_lock = threading.Lock()
+
+    def __init__(self, key_claude: str = "", http_proxy: str = None, claude_cache: ClaudeCache = None, cache_bypass: bool = False, claude_url: str = "") -> None:
+        self.url = claude_url if claude_url else "https://api.anthropic.com/v1/complete"
         self.header = {
             "accept": "application/json",
             "anthropic-version": "2023-06-01",
@@ -39,78 +214,271 @@ class ClaudeClient(object):
         }
         self.body = {"model": "claude-2", "max_tokens_to_sample": 10000}
         self.proxy = {"http": http_proxy, "https": http_proxy} if http_proxy else None
+        self.cache = claude_cache
+        self.cache_bypass = cache_bypass
+        self.rank_cache = dict()
+        self.max_retry = 5
+        self.timeout = 600
+
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        """
+        Get the process-wide HTTP session with pooled keep-alive connections
+        """
+        with cls.session_lock:
+            if cls.session is None:
+                cls.session = requests.Session()
+                cls.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+                cls.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+            return cls.session
+
+    @staticmethod
+    def get_backoff(retry: int = 0, retry_after: str = None) -> float:
+        """
+        Get the delay before a retry, honoring Retry-After
+        """
+        try:
+            return max(float(retry_after), 0.0)
+        except (TypeError, ValueError):
+            return random.uniform(0.5, 1.0) * min(2 ** retry, 60)
+
+    def get_response(self, claude_body: Dict[str, Any], claude_stream: bool = False) -> requests.Response:
+        """
+        Post a request with rate limiting and retries, streaming the response body or not.
+        A streamed body is read after this returns, so the caller holds the ClaudeLimiter.semaphore permit until it closes the response.
+        """
+        for claude_retry in range(self.max_retry + 1):
+            ClaudeLimiter.acquire()
+            try:
+                if claude_stream:
+                    claude_response = self.get_session().post(url=self.url, headers=dict(self.header, accept="text/event-stream"), json=dict(claude_body, stream=True), proxies=self.proxy, timeout=self.timeout, stream=True)
+                else:
+                    with ClaudeLimiter.semaphore:
+                        claude_response = self.get_session().post(url=self.url, headers=self.header, json=claude_body, proxies=self.proxy, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if claude_retry == self.max_retry:
+                    raise
+                claude_delay, claude_error = self.get_backoff(claude_retry), type(e).__name__
+            else:
+                if claude_response.status_code not in RETRY_STATUS or claude_retry == self.max_retry:
+                    break
+                claude_response.close()
+                claude_delay, claude_error = self.get_backoff(claude_retry, claude_response.headers.get("retry-after")), claude_response.status_code
+                if claude_response.status_code == 429:
+                    ClaudeLimiter.pause(claude_delay)
+            print(f"Claude request failed ({claude_error}), retrying in {round(claude_delay, 2)} s.")
+            time.sleep(claude_delay)
+        claude_response.raise_for_status()
+        return claude_response
+
+    def get_completion(self, prompt: str = "") -> str:
+        claude_body = dict(self.body, prompt=prompt)
+        if self.cache and not self.cache_bypass:
+            claude_completion = self.cache.get(claude_body)
+            if claude_completion is not None:
+                return claude_completion
+        claude_completion = self.get_response(claude_body).json().get("completion", "")
+        if self.cache and claude_completion:
+            self.cache.put(claude_body, claude_completion)
+        return claude_completion
+
+    @staticmethod
+    def get_event(claude_response: requests.Response) -> Iterator[Tuple[str, str]]:
+        """
+        Parse server-sent events into (event, data)
+        """
+        claude_response.encoding = "utf-8"
+        claude_event, claude_data = "message", list()
+        for claude_line in claude_response.iter_lines(chunk_size=None, decode_unicode=True):
+            if not claude_line:
+                if claude_data:
+                    yield claude_event, "\n".join(claude_data)
+                claude_event, claude_data = "message", list()
+            elif claude_line.startswith("event:"):
+                claude_event = claude_line[6:].strip()
+            elif claude_line.startswith("data:"):
+                claude_data.append(claude_line[5:].lstrip())
+        if claude_data:
+            yield claude_event, "\n".join(claude_data)
+
+    def get_stream(self, prompt: str = "") -> Iterator[str]:
+        """
+        Stream a completion as text deltas, caching it once the stream ends
+        """
+        claude_body = dict(self.body, prompt=prompt)
+        if self.cache and not self.cache_bypass:
+            claude_completion = self.cache.get(claude_body)
+            if claude_completion is not None:
+                yield claude_completion
+                return
+        claude_completion = list()
+        # Keep the permit until the body is read, as configure may swap the semaphore meanwhile
+        claude_semaphore = ClaudeLimiter.semaphore
+        claude_semaphore.acquire()
+        try:
+            with self.get_response(claude_body, True) as claude_response:
+                for claude_event, claude_data in self.get_event(claude_response):
+                    if claude_event == "error":
+                        raise RuntimeError("Claude stream failed", claude_data)
+                    if claude_event != "completion":
+                        continue
+                    claude_delta = json.loads(claude_data).get("completion", "")
+                    if claude_delta:
+                        claude_completion.append(claude_delta)
+                        yield claude_delta
+        finally:
+            claude_semaphore.release()
+        if self.cache and claude_completion:
+            self.cache.put(claude_body, "".join(claude_completion))
+
+    def get_line_stream(self, prompt: str = "") -> Iterator[str]:
+        """
+        Stream a completion line by line
+        """
+        claude_line = ""
+        for claude_delta in self.get_stream(prompt):
+            claude_line += claude_delta
+            *claude_done, claude_line = claude_line.split("\n")
+            yield from claude_done
+        if claude_line:
+            yield claude_line
+
+    def get_summary_stream(self, language: str = "", duration: float = 0.0, doc: str = "", summary_aid: str = "") -> Iterator[SummaryDraft]:
+        """
+        Stream key moments as summary drafts once each line completes
+        """
+        claude_prompt = PROMPT_SUMMARY_ZH if language == "zh" else PROMPT_SUMMARY_EN
+        for claude_line in self.get_line_stream(claude_prompt.format(s2t(duration), doc)):
+            print(claude_line)
+            for claude_start, claude_content in parse_summary(claude_line):
+                yield SummaryDraft(summary_aid=summary_aid, summary_content=claude_content, summary_start=claude_start)
+
+    def get_view_stream(self, language: str = "", doc: str = "", view_aid: str = "") -> Iterator[ViewDraft]:
+        """
+        Stream views as view drafts once each line completes
+        """
+        claude_prompt = PROMPT_VIEW_ZH if language == "zh" else PROMPT_VIEW_EN
+        for claude_line in self.get_line_stream(claude_prompt.format(doc)):
+            print(claude_line)
+            for claude_content in parse_view(claude_line):
+                if claude_content:
+                    yield ViewDraft(view_aid=view_aid, view_content=claude_content)
 
     def get_keyword_zh(self, doc: str = "") -> List[str]:
-        self.body["prompt"] = PROMPT_KEYWORD_ZH.format(doc)
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_keyword = claude_response.json().get("completion", "")
+        claude_keyword = self.get_completion(PROMPT_KEYWORD_ZH.format(doc))
         print(claude_keyword)
-        return [y.strip() for x in [
-            re.sub("^\d*\.\s|^\d*\.|^-\s|^-|^\s*|\s$", "", x).split(",")
-            for x in claude_keyword.split("\n\n")[1].split("\n")
-        ] for y in x]
+        return parse_keyword(claude_keyword)
 
     def get_keyword_en(self, doc: str = "") -> List[str]:
-        self.body["prompt"] = PROMPT_KEYWORD_EN.format(doc)
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_keyword = claude_response.json().get("completion", "")
+        claude_keyword = self.get_completion(PROMPT_KEYWORD_EN.format(doc))
         print(claude_keyword)
-        return [y.strip() for x in [
-            re.sub("^\d*\.\s|^\d*\.|^-\s|^-|^\s*|\s$", "", x).split(",")
-            for x in claude_keyword.split("\n\n")[1].split("\n")
-            ] for y in x]
+        return parse_keyword(claude_keyword)
 
     def get_summary_zh(self, duration: float = 0.0, doc: str = "") -> List[tuple]:
-        self.body["prompt"] = PROMPT_SUMMARY_ZH.format(s2t(duration), doc)
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_summary = claude_response.json().get("completion", "")
+        claude_summary = self.get_completion(PROMPT_SUMMARY_ZH.format(s2t(duration), doc))
         print(claude_summary)
-        return [
-            (t2s(re.match("^\s*\d\d:\d\d:\d\d", x).group()), re.sub("^\s*\d\d:\d\d:\d\d\s*-\s*", "", x).strip())
-            for x in claude_summary.split("\n")
-            if x and re.match("^\s*\d\d:\d\d:\d\d", x)
-        ]
+        return parse_summary(claude_summary)
 
     def get_summary_en(self, duration: float = 0.0, doc: str = "") -> List[tuple]:
-        self.body["prompt"] = PROMPT_SUMMARY_EN.format(s2t(duration), doc)
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_summary = claude_response.json().get("completion", "")
+        claude_summary = self.get_completion(PROMPT_SUMMARY_EN.format(s2t(duration), doc))
         print(claude_summary)
-        return [
-            (t2s(re.match("^\s*\d\d:\d\d:\d\d", x).group()), re.sub("^\s*\d\d:\d\d:\d\d\s*-\s*", "", x).strip())
-            for x in claude_summary.split("\n")
-            if x and re.match("^\s*\d\d:\d\d:\d\d", x)
-        ]
+        return parse_summary(claude_summary)
 
     def get_view_zh(self, doc: str = "") -> List[str]:
-        self.body["prompt"] = PROMPT_VIEW_ZH.format(doc)
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_view = claude_response.json().get("completion", "")
+        claude_view = self.get_completion(PROMPT_VIEW_ZH.format(doc))
         print(claude_view)
-        return [
-            re.sub("^\d*\.\s|^\d*\.|^-\s|^-|^\s*|\s$", "", x).strip()
-            for x in claude_view.split("\n")
-            if x
-        ]
+        return parse_view(claude_view)
 
     def get_view_en(self, doc: str = "") -> List[str]:
-        self.body["prompt"] = PROMPT_VIEW_EN.format(doc)
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_view = claude_response.json().get("completion", "")
+        claude_view = self.get_completion(PROMPT_VIEW_EN.format(doc))
         print(claude_view)
-        return [
-            re.sub("^\d*\.\s|^\d*\.|^-\s|^-|^\s*|\s$", "", x).strip()
-            for x in claude_view.split("\n")
-            if x
-        ]
+        return parse_view(claude_view)
+
+    def get_combine_zh(self, duration: float = 0.0, doc: str = "") -> Dict[str, list]:
+        claude_combine = self.get_completion(PROMPT_COMBINE_ZH.format(s2t(duration), doc))
+        print(claude_combine)
+        return parse_combine(claude_combine)
+
+    def get_combine_en(self, duration: float = 0.0, doc: str = "") -> Dict[str, list]:
+        claude_combine = self.get_completion(PROMPT_COMBINE_EN.format(s2t(duration), doc))
+        print(claude_combine)
+        return parse_combine(claude_combine)
+
+    @staticmethod
+    def get_chunk(sentence_list: List[Tuple[float, float, str]], chunk_size: int = 6000) -> List[List[Tuple[float, float, str]]]:
+        """
+        Split (start, end, content) sentences into chunks of about chunk_size characters on sentence boundaries
+        """
+        chunk_list, chunk_length = [[]], 0
+        for sentence in sentence_list:
+            if chunk_list[-1] and chunk_length + len(sentence[2]) > chunk_size:
+                chunk_list.append(list())
+                chunk_length = 0
+            chunk_list[-1].append(sentence)
+            chunk_length += len(sentence[2]) + 1
+        return [x for x in chunk_list if x]
+
+    def get_keyword_chunk(self, language: str = "", sentence_list: List[Tuple[float, float, str]] = list(), chunk_size: int = 6000, max_keyword: int = 10) -> List[str]:
+        """
+        Map-reduce keywords: extract keywords from chunks in parallel and keep those found in the most chunks
+        """
+        chunk_list = self.get_chunk(sentence_list, chunk_size)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            keyword_list = [y.strip() for x in executor.map(
+                self.get_keyword_zh if language == "zh" else self.get_keyword_en,
+                [" ".join([y[2] for y in x]) for x in chunk_list]
+                ) for y in x if y.strip()]
+        keyword_count = dict()
+        for keyword in keyword_list:
+            keyword_count.setdefault(keyword.lower(), [0, keyword])[0] += 1
+        return [x[1] for x in sorted(keyword_count.values(), key=lambda x: -x[0])][:max_keyword]
+
+    def get_summary_chunk(self, language: str = "", duration: float = 0.0, sentence_list: List[Tuple[float, float, str]] = list(), chunk_size: int = 6000, max_summary: int = 30) -> List[tuple]:
+        """
+        Map-reduce summary: summarize chunks in parallel and merge them in time order
+        """
+        chunk_list = self.get_chunk(sentence_list, chunk_size)
+        chunk_max = max(max_summary // max(len(chunk_list), 1), 3)
+
+        def chunk_summary(chunk: List[Tuple[float, float, str]], chunk_end: float) -> List[tuple]:
+            claude_summary = self.get_completion((PROMPT_SUMMARY_CHUNK_ZH if language == "zh" else PROMPT_SUMMARY_CHUNK_EN).format(
+                chunk_max, s2t(chunk[0][0]), s2t(chunk_end), "\n".join([f"[{s2t(x[0])}] {x[2]}" for x in chunk])
+                ))
+            print(claude_summary)
+            return [(min(max(x, int(chunk[0][0])), int(chunk_end)), y) for x, y in parse_summary(claude_summary)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            summary_list = [y for x in executor.map(
+                chunk_summary,
+                chunk_list,
+                [x[-1][1] if i < len(chunk_list) - 1 else max(duration, x[-1][1]) for i, x in enumerate(chunk_list)]
+                ) for y in x]
+        summary_list = sorted(summary_list, key=lambda x: x[0])
+        if len(summary_list) > max_summary:
+            summary_list = [summary_list[x * len(summary_list) // max_summary] for x in range(max_summary)]
+        return summary_list
+
+    def get_view_chunk(self, language: str = "", sentence_list: List[Tuple[float, float, str]] = list(), chunk_size: int = 6000) -> List[str]:
+        """
+        Map-reduce views: extract views from chunks in parallel and merge them with one more request
+        """
+        chunk_list = self.get_chunk(sentence_list, chunk_size)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            view_list = [y for x in executor.map(
+                self.get_view_zh if language == "zh" else self.get_view_en,
+                [" ".join([y[2] for y in x]) for x in chunk_list]
+                ) for y in x]
+        if len(chunk_list) < 2:
+            return view_list
+        claude_view = self.get_completion((PROMPT_VIEW_MERGE_ZH if language == "zh" else PROMPT_VIEW_MERGE_EN).format("\n".join(view_list)))
+        print(claude_view)
+        return parse_view(claude_view)
 
     def get_recommend_none(self, doc_list: List[str] = list()) -> List[int]:
-        self.body["prompt"] = PROMPT_RECOMMEND_NONE.format(
+        claude_sort = self.get_completion(PROMPT_RECOMMEND_NONE.format(
             len(doc_list),
             "\n\n".join([f"第{x + 1}篇音频文本: {y}" for x, y in enumerate(doc_list)])
-        )
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_sort = claude_response.json().get("completion", "")
+        ))
         print(claude_sort)
         claude_sort = [max(int(x.strip()) - 1, 0) for x in re.findall(r"\s\d+|\d+\s", claude_sort) if int(x.strip()) <= len(doc_list)]
         claude_sort = sorted(set(claude_sort), key=claude_sort.index)
@@ -119,17 +487,49 @@ class ClaudeClient(object):
         return claude_sort
 
     def get_recommend_wiki(self, doc_list: List[str] = list(), view_dict: Dict[bool, List[str]] = dict()) -> List[int]:
-        self.body["prompt"] = PROMPT_RECOMMEND_WIKI.format(
+        claude_sort = self.get_completion(PROMPT_RECOMMEND_WIKI.format(
             len(doc_list),
             "\n\n".join([f"观点{x + 1}: {y}" for x, y in enumerate(view_dict[True])]),
             "\n\n".join([f"观点{x + 1}: {y}" for x, y in enumerate(view_dict[False])]),
             "\n\n".join([f"第{x + 1}篇音频文本: {y}" for x, y in enumerate(doc_list)])
-        )
-        claude_response = requests.request("POST", url=self.url, headers=self.header, json=self.body, proxies=self.proxy)
-        claude_sort = claude_response.json().get("completion", "")
+        ))
         print(claude_sort)
         claude_sort = [max(int(x.strip()) - 1, 0) for x in re.findall(r"\s\d+|\d+\s", claude_sort) if int(x.strip()) <= len(doc_list)]
         claude_sort = sorted(set(claude_sort), key=claude_sort.index)
         claude_sort.extend(list(set([x for x in range(len(doc_list))]) - set(claude_sort)))
         print(claude_sort)
         return claude_sort
+
+    def get_recommend_group(self, doc_list: List[str] = list(), view_dict: Dict[bool, List[str]] = None) -> List[int]:
+        """
+        Rank a group of documents with one request, memoizing the ordering
+        """
+        if len(doc_list) < 2:
+            return list(range(len(doc_list)))
+        rank_key = hashlib.sha256(json.dumps([doc_list, view_dict if view_dict else dict()], ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        if rank_key not in self.rank_cache:
+            self.rank_cache[rank_key] = self.get_recommend_wiki(doc_list, view_dict) if view_dict else self.get_recommend_none(doc_list)
+        return self.rank_cache[rank_key]
+
+    def get_recommend_tournament(self, doc_list: List[str] = list(), view_dict: Dict[bool, List[str]] = None, group_size: int = 10, group_keep: int = 3, max_workers: int = 4) -> List[int]:
+        """
+        Rank any number of documents with a tournament.
+        Each round splits the candidates into balanced groups ranked concurrently,
+        and only the top group_keep of each group advance until one group remains.
+        The others follow the final ordering, later rounds and better group places first.
+        """
+        group_size = max(group_size, 2)
+        group_keep = max(min(group_keep, group_size // 2), 1)
+        rank_round = list(range(len(doc_list)))
+        rank_tail = list()
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            while len(rank_round) > group_size:
+                group_num = -(-len(rank_round) // group_size)
+                group_list = [rank_round[i::group_num] for i in range(group_num)]
+                group_sort = list(executor.map(
+                    lambda x: [x[y] for y in self.get_recommend_group([doc_list[z] for z in x], view_dict)],
+                    group_list
+                    ))
+                rank_round = [x for y in group_sort for x in y[:group_keep]]
+                rank_tail = [y[i] for i in range(group_keep, group_size + 1) for y in group_sort if i < len(y)] + rank_tail
+        return [rank_round[x] for x in self.get_recommend_group([doc_list[x] for x in rank_round], view_dict)] + rank_tail
@@ -0,0 +1,81 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+from pickpod.task import STAGE_LOCAL, STAGE_REMOTE, PickpodTask
+
+
+class PickpodBatch(object):
+    """
+    Pipelined batch runner for pickpod tasks.
+    A bounded pool downloads the next episodes while the current one is transcribed,
+    local stages (decoding, transcription, speaker diarization) run one episode at a time,
+    and remote Claude stages with persistence overlap in their own pool.
+    At most max_prefetch downloaded episodes wait for transcription, which bounds disk usage.
+    """
+
+    def __init__(
+            self,
+            task_list: List[PickpodTask], # Pickpod tasks to run in order
+            max_download: int = 2, # Concurrent downloads
+            max_prefetch: int = 2, # Episodes downloaded ahead of transcription
+            max_claude: int = 2, # Episodes running remote stages concurrently
+            save_db: bool = True # Save results to database or not
+            ) -> None:
+        self.task_list = task_list
+        self.max_download = max(max_download, 1)
+        self.max_prefetch = max(max_prefetch, 1)
+        self.max_claude = max(max_claude, 1)
+        self.save_db = save_db
+        self.timing = dict()
+
+    def task_download(self, pickpod_task: PickpodTask) -> None:
+        start_time = time.time()
+        pickpod_task.pickpod_download()
+        self.timing[pickpod_task.audio_draft.uuid] = time.time() - start_time
+        print(f"The downloading of \"{pickpod_task.audio_draft.title}\" is done, using time: {self.timing[pickpod_task.audio_draft.uuid]} s")
+
+    def task_remote(self, pickpod_task: PickpodTask) -> None:
+        try:
+            pickpod_task.pickpod_flow(STAGE_REMOTE + (["persist"] if self.save_db else [])).run()
+        except Exception as e:
+            print("Pickpod task failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+
+    def download_iter(self) -> Iterator[Tuple[PickpodTask, Exception]]:
+        """
+        Yield tasks in order as soon as their downloads finish, downloading ahead within max_prefetch
+        """
+        with ThreadPoolExecutor(max_workers=self.max_download) as executor:
+            future_list = [executor.submit(self.task_download, x) for x in self.task_list[:self.max_prefetch]]
+            for i, pickpod_task in enumerate(self.task_list):
+                yield pickpod_task, future_list[i].exception()
+                if i + self.max_prefetch < len(self.task_list):
+                    future_list.append(executor.submit(self.task_download, self.task_list[i + self.max_prefetch]))
+
+    def run(self) -> List[PickpodTask]:
+        """
+        Run all tasks and return the ones whose local stages succeeded
+        """
+        task_done = list()
+        with ThreadPoolExecutor(max_workers=self.max_claude) as executor:
+            future_list = list()
+            for pickpod_task, download_error in self.download_iter():
+                if download_error:
+                    e = download_error
+                    print("Pickpod download failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+                    continue
+                try:
+                    pickpod_task.pickpod_flow(STAGE_LOCAL).run()
+                except Exception as e:
+                    print("Pickpod task failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+                    continue
+                finally:
+                    pickpod_task.audio_buffer = None
+                task_done.append(pickpod_task)
+                future_list.append(executor.submit(self.task_remote, pickpod_task))
+            for future in future_list:
+                future.result()
+        return task_done
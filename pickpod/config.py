@@ -2,8 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import sqlite3
-from typing import Any, Dict
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from pickpod.draft import CacheSQL
 
 
 # yt-dlp basic configuration
@@ -16,11 +21,145 @@ YDL_OPTION = {
     }
 
 
+# Schema migrations of the pickpod database, the n-th script upgrades user_version n to n + 1
+DB_MIGRATION = [
+    """
+    -- ----------------------------
+    -- Table structure for audio
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS "audio" (
+    "id" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM PRIMARY KEY AUTOINCREMENT,
+    "uuid" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "title" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "ext" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "web" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "url" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "duration" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "language" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "description" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "keyword" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "path" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "origin" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "status" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 1 COLLATE RTRIM,
+    "createTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "updateTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM
+    );
+
+    -- ----------------------------
+    -- Table structure for formation
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS "formation" (
+    "id" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM PRIMARY KEY AUTOINCREMENT,
+    "uuid" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "audioId" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "content" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "mark" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "target" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "status" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 1 COLLATE RTRIM,
+    "createTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "updateTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM
+    );
+
+    -- ----------------------------
+    -- Table structure for sentence
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS "sentence" (
+    "id" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM PRIMARY KEY AUTOINCREMENT,
+    "uuid" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "audioId" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "content" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
+    "start" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "end" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "speaker" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "status" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 1 COLLATE RTRIM,
+    "createTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
+    "updateTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM
+    );
+    """,
+    """
+    -- ----------------------------
+    -- Indexes for sentence
+    -- ----------------------------
+    CREATE INDEX IF NOT EXISTS "sentence_audio" ON "sentence" ("audioId", "status", "start");
+    CREATE INDEX IF NOT EXISTS "sentence_uuid" ON "sentence" ("uuid");
+
+    -- ----------------------------
+    -- Indexes for formation
+    -- ----------------------------
+    CREATE INDEX IF NOT EXISTS "formation_audio" ON "formation" ("audioId", "target", "status", "mark");
+    CREATE INDEX IF NOT EXISTS "formation_mark" ON "formation" ("mark", "target", "status", "createTime");
+    CREATE INDEX IF NOT EXISTS "formation_uuid" ON "formation" ("uuid");
+
+    -- ----------------------------
+    -- Indexes for audio
+    -- ----------------------------
+    CREATE INDEX IF NOT EXISTS "audio_status" ON "audio" ("status", "createTime");
+    CREATE INDEX IF NOT EXISTS "audio_uuid" ON "audio" ("uuid");
+    """,
+    """
+    -- ----------------------------
+    -- Table structure for idf
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS "idf" (
+    "term" text NOT NULL PRIMARY KEY,
+    "df" integer NOT NULL DEFAULT 0
+    );
+
+    -- ----------------------------
+    -- Table structure for idf_audio
+    -- ----------------------------
+    CREATE TABLE IF NOT EXISTS "idf_audio" (
+    "audioId" text NOT NULL PRIMARY KEY
+    );
+    """,
+    """
+    -- ----------------------------
+    -- Full-text index for sentence
+    -- ----------------------------
+    CREATE VIRTUAL TABLE IF NOT EXISTS "sentence_fts" USING fts5 (content, content='sentence', content_rowid='id', tokenize='trigram');
+    INSERT INTO "sentence_fts" ("sentence_fts") VALUES ('rebuild');
+    CREATE TRIGGER IF NOT EXISTS "sentence_fts_insert" AFTER INSERT ON "sentence" BEGIN
+    INSERT INTO "sentence_fts" (rowid, content) VALUES (new.id, new.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS "sentence_fts_delete" AFTER DELETE ON "sentence" BEGIN
+    INSERT INTO "sentence_fts" ("sentence_fts", rowid, content) VALUES ('delete', old.id, old.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS "sentence_fts_update" AFTER UPDATE OF content ON "sentence" BEGIN
+    INSERT INTO "sentence_fts" ("sentence_fts", rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO "sentence_fts" (rowid, content) VALUES (new.id, new.content);
+    END;
+
+    -- ----------------------------
+    -- Full-text index for audio
+    -- ----------------------------
+    CREATE VIRTUAL TABLE IF NOT EXISTS "audio_fts" USING fts5 (title, description, keyword, content='audio', content_rowid='id', tokenize='trigram');
+    INSERT INTO "audio_fts" ("audio_fts") VALUES ('rebuild');
+    CREATE TRIGGER IF NOT EXISTS "audio_fts_insert" AFTER INSERT ON "audio" BEGIN
+    INSERT INTO "audio_fts" (rowid, title, description, keyword) VALUES (new.id, new.title, new.description, new.keyword);
+    END;
+    CREATE TRIGGER IF NOT EXISTS "audio_fts_delete" AFTER DELETE ON "audio" BEGIN
+    INSERT INTO "audio_fts" ("audio_fts", rowid, title, description, keyword) VALUES ('delete', old.id, old.title, old.description, old.keyword);
+    END;
+    CREATE TRIGGER IF NOT EXISTS "audio_fts_update" AFTER UPDATE OF title, description, keyword ON "audio" BEGIN
+    INSERT INTO "audio_fts" ("audio_fts", rowid, title, description, keyword) VALUES ('delete', old.id, old.title, old.description, old.keyword);
+    INSERT INTO "audio_fts" (rowid, title, description, keyword) VALUES (new.id, new.title, new.description, new.keyword);
+    END;
+    """,
+    """
+    -- ----------------------------
+    -- Keyset pagination index for sentence
+    -- ----------------------------
+    CREATE INDEX IF NOT EXISTS "sentence_page" ON "sentence" ("audioId", "status", "start", "uuid");
+    DROP INDEX IF EXISTS "sentence_audio";
+    """
+    ]
+
+
 class TaskConfig(object):
     """
     Configuration class for a pickpod task.
     Every argument is optional.
-    If using speaker diarization, a Hugging Face Key is required.
+    If using speaker diarization, a Hugging Face Key or a local pyannote checkpoint is required.
     If using summary, keywords, or views, a Claude Key is needed.
     """
 
@@ -30,12 +169,23 @@ class TaskConfig(object):
             key_claude: str = "", # User key for claude
             ydl_option: Dict[str, Any] = None, # Configuration of yt_dlp
             path_wav: str = "", # WAV output path
+            path_audio: str = "", # Audio download path (WAV output path by default)
             path_db: str = "", # Database save path
+            path_pyannote: str = "", # Local pyannote checkpoint directory
             task_language: str = "", # Audio language for WhisperModel
             task_prompt: str = "", # Audio prompt for WhisperModel
             task_proxy: str = "",
+            claude_cache: bool = False, # Cache Claude completions next to the database or not
+            claude_chunk: int = 0, # Transcript characters per request for map-reduce keywords, summary and views (0 for a single request)
+            claude_combine: bool = False, # Extract keywords, summary and views in one request or not
+            claude_stream: bool = False, # Stream summary and views line by line or not
             pipeline: bool = False, # Get speaker diarization or not
+            pipeline_split: bool = False, # Split sentences where the speaker changes or not
+            concurrent: bool = False, # Run transcription and speaker diarization concurrently or not
+            thread_whisper: int = 0, # CPU threads for WhisperModel (0 for default)
+            thread_pyannote: int = 0, # CPU threads for pyannote.audio (0 for default)
             keyword: bool = False, # Get keyword or not
+            keyword_backend: str = "claude", # Keyword backend ("claude" or "local" TF-IDF)
             summary: bool = False, # Get summary or not
             view: bool = False # Get view or not
             ) -> None:
@@ -43,112 +193,349 @@ class TaskConfig(object):
         self.claude = key_claude
         self.ydl_option = ydl_option if ydl_option else YDL_OPTION
         self.path_wav = path_wav if path_wav else os.getcwd()
+        self.path_audio = path_audio if path_audio else self.path_wav
         self.path_db = path_db if path_db else os.getcwd()
+        self.path_pyannote = path_pyannote
         self.language = task_language if task_language else None
         self.prompt = task_prompt if task_prompt else None
         self.proxy = task_proxy if task_proxy else None
+        self.claude_cache = claude_cache
+        self.claude_chunk = claude_chunk
+        self.claude_combine = claude_combine
+        self.claude_stream = claude_stream
         self.pipeline = pipeline
+        self.pipeline_split = pipeline_split
+        self.concurrent = concurrent
+        self.thread_whisper = thread_whisper
+        self.thread_pyannote = thread_pyannote
         self.keyword = keyword
+        self.keyword_backend = keyword_backend
         self.summary = summary
         self.view = view
 
+
+class DBCache(object):
+    """
+    Read-through LRU cache of query rows, keyed by (table, uuid or audioId).
+    Only draft reads built as CacheSQL are cached, bounded by entry count and bytes,
+    and writes executed through a client invalidate the rows they touch.
+    """
+
+    def __init__(
+            self,
+            max_entry: int = 2048, # Maximum cached keys
+            max_byte: int = 64 * 1024 * 1024 # Maximum estimated size of cached rows in bytes
+            ) -> None:
+        self.max_entry = max_entry
+        self.max_byte = max_byte
+        self.entry = OrderedDict()
+        self.owner = dict()
+        self.owned = dict()
+        self.size = 0
+        self.version = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def get_key(sql: str = "", arg: tuple = tuple()) -> tuple:
+        """
+        Get the (table, uuid or audioId) key of a query, or None if it is not cacheable
+        """
+        if not isinstance(sql, CacheSQL):
+            return None
+        cache_match = re.match(r"^SELECT .+? FROM (\w+) WHERE (uuid|audioId)=\?", sql)
+        return (cache_match.group(1), arg[0]) if cache_match and arg else None
+
+    @staticmethod
+    def get_size(rows: list) -> int:
+        return 64 + sum([64 + sum([len(x) if isinstance(x, str) else 8 for x in y]) for y in rows])
+
+    def get(self, sql: str = "", arg: tuple = tuple()) -> list:
+        cache_key = self.get_key(sql, arg)
+        with self.lock:
+            if cache_key not in self.entry or (sql, arg) not in self.entry[cache_key]:
+                return None
+            self.entry.move_to_end(cache_key)
+            return self.entry[cache_key][(sql, arg)]
+
+    def put(self, sql: str = "", arg: tuple = tuple(), rows: list = None, version: int = 0) -> None:
+        cache_key = self.get_key(sql, arg)
+        with self.lock:
+            if cache_key is None or version != self.version:
+                return
+            cache_entry = self.entry.setdefault(cache_key, dict())
+            if (sql, arg) in cache_entry:
+                self.size -= self.get_size(cache_entry[(sql, arg)])
+            cache_entry[(sql, arg)] = rows
+            self.entry.move_to_end(cache_key)
+            self.size += self.get_size(rows)
+            for x in rows:
+                if x and isinstance(x[0], str):
+                    self.owner.setdefault((cache_key[0], x[0]), set()).add(cache_key)
+                    self.owned.setdefault(cache_key, set()).add((cache_key[0], x[0]))
+            while self.entry and (len(self.entry) > self.max_entry or self.size > self.max_byte):
+                self.pop(next(iter(self.entry)))
+
+    def pop(self, cache_key: tuple) -> None:
+        with self.lock:
+            for x in self.entry.pop(cache_key, dict()).values():
+                self.size -= self.get_size(x)
+            for x in self.owned.pop(cache_key, set()):
+                owner_set = self.owner.get(x)
+                if owner_set is not None:
+                    owner_set.discard(cache_key)
+                    if not owner_set:
+                        del self.owner[x]
+
+    def invalidate(self, sql: str = "", arg: tuple = tuple()) -> None:
+        """
+        Drop the cached rows touched by a write
+        """
+        with self.lock:
+            self.version += 1
+            write_match = re.match(r"^\s*(?:INSERT(?: OR \w+)? INTO|UPDATE|DELETE FROM) (\w+)", sql)
+            if not write_match:
+                return
+            write_tb = write_match.group(1)
+            insert_match = re.match(r"^\s*INSERT(?: OR \w+)? INTO \w+ \(([^)]*)\) VALUES", sql)
+            if insert_match:
+                write_col = dict(zip([x.strip() for x in insert_match.group(1).split(",")], arg))
+                write_key = [(write_tb, write_col[x]) for x in ("uuid", "audioId") if x in write_col]
+            elif re.search(r"WHERE uuid=\?$", sql.strip()):
+                write_key = [(write_tb, arg[-1])]
+            else:
+                write_key = [x for x in self.entry if x[0] == write_tb]
+            for x in write_key:
+                self.pop(x)
+                for y in self.owner.pop(x, set()):
+                    self.pop(y)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.version += 1
+            self.entry.clear()
+            self.owner.clear()
+            self.owned.clear()
+            self.size = 0
+
+
+class DBPool(object):
+    """
+    Process-wide SQLite connection manager, one per database file.
+    Connections run in WAL mode with tuned pragmas and a busy timeout, every thread gets its own connection,
+    and writes are serialized by one writer lock so that readers never wait behind a writer.
+    Short-lived threads release their connection when done, and the next thread reuses it.
+    """
+
+    pool_dict = dict()
+    pool_lock = threading.Lock()
+
+    def __init__(
+            self,
+            path_file: str = "", # Database file path
+            busy_timeout: int = 30000, # Busy timeout in milliseconds
+            mmap_size: int = 268435456, # Memory-mapped I/O size in bytes
+            cache_size: int = 65536, # Page cache size in KB per connection
+            max_idle: int = 8 # Released connections kept open for reuse
+            ) -> None:
+        self.path = path_file
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.max_idle = max_idle
+        self.idle = list()
+        self.idle_lock = threading.Lock()
+        self.local = threading.local()
+        self.write_lock = threading.RLock()
+        self.cache = None
+
+    @classmethod
+    def get_pool(cls, path_file: str = "") -> object:
+        """
+        Get the pool of a database file, creating it if necessary
+        """
+        path_file = os.path.abspath(path_file)
+        with cls.pool_lock:
+            if path_file not in cls.pool_dict:
+                cls.pool_dict[path_file] = DBPool(path_file)
+            return cls.pool_dict[path_file]
+
+    def set_cache(self, db_cache: DBCache) -> DBCache:
+        """
+        Attach a cache unless the pool already owns one, returning the cache of the pool
+        """
+        with DBPool.pool_lock:
+            if self.cache is None:
+                self.cache = db_cache
+            return self.cache
+
+    def get_conn(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current thread, opening it if necessary
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            with self.idle_lock:
+                conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            conn.execute(f"PRAGMA cache_size=-{int(self.cache_size)}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+        self.local.conn = conn
+        return conn
+
+    def release(self) -> None:
+        """
+        Hand the connection of the current thread over to the next thread, closing it beyond max_idle
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            return
+        self.local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self.idle_lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+
 class DBClient(object):
+    """
+    Client of a pickpod database.
+    Connections come from the process-wide pool of the database file,
+    so clients are cheap to create and safe to share between threads.
+    A cache given to a client is attached to the pool of the file unless the pool already owns one,
+    so all clients of the file read and invalidate the same cache.
+    """
 
-    def __init__(self, path_db: str = "", name_db: str = "pickpod.db") -> None:
-        self.conn = sqlite3.connect(os.path.join(path_db, name_db))
+    def __init__(self, path_db: str = "", name_db: str = "pickpod.db", verbose: bool = True, db_cache: DBCache = None) -> None:
+        self.pool = DBPool.get_pool(os.path.join(path_db, name_db))
+        self.verbose = verbose
+        if db_cache is not None:
+            self.pool.set_cache(db_cache)
 
-    def create_tb(self) -> None:
-        cur = self.conn.cursor()
-        cur.executescript("""
-            PRAGMA foreign_keys = false;
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self.pool.get_conn()
 
-            -- ----------------------------
-            -- Table structure for audio
-            -- ----------------------------
+    def create_tb(self) -> None:
+        """
+        Drop all tables and create the latest schema
+        """
+        self.executescript("""
             DROP TABLE IF EXISTS "audio";
-            CREATE TABLE "audio" (
-            "id" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM PRIMARY KEY AUTOINCREMENT,
-            "uuid" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "title" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "ext" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "web" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "url" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "duration" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "language" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "description" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "keyword" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "path" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "origin" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "status" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 1 COLLATE RTRIM,
-            "createTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "updateTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM
-            );
-
-            -- ----------------------------
-            -- Table structure for formation
-            -- ----------------------------
             DROP TABLE IF EXISTS "formation";
-            CREATE TABLE "formation" (
-            "id" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM PRIMARY KEY AUTOINCREMENT,
-            "uuid" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "audioId" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "content" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "mark" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "target" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "status" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 1 COLLATE RTRIM,
-            "createTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "updateTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM
-            );
-
-            -- ----------------------------
-            -- Table structure for sentence
-            -- ----------------------------
             DROP TABLE IF EXISTS "sentence";
-            CREATE TABLE "sentence" (
-            "id" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM PRIMARY KEY AUTOINCREMENT,
-            "uuid" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "audioId" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "content" text NOT NULL ON CONFLICT ROLLBACK DEFAULT '' COLLATE RTRIM,
-            "start" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "end" real NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "speaker" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "status" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 1 COLLATE RTRIM,
-            "createTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM,
-            "updateTime" integer NOT NULL ON CONFLICT ROLLBACK DEFAULT 0 COLLATE RTRIM
-            );
-
-            -- ----------------------------
-            -- Auto increment value for audio
-            -- ----------------------------
-            UPDATE "main"."sqlite_sequence" SET seq = 0 WHERE name = 'audio';
-
-            -- ----------------------------
-            -- Auto increment value for formation
-            -- ----------------------------
-            UPDATE "main"."sqlite_sequence" SET seq = 0 WHERE name = 'formation';
-
-            -- ----------------------------
-            -- Auto increment value for sentence
-            -- ----------------------------
-            UPDATE "main"."sqlite_sequence" SET seq = 0 WHERE name = 'sentence';
-
-            PRAGMA foreign_keys = true;
+            DROP TABLE IF EXISTS "idf";
+            DROP TABLE IF EXISTS "idf_audio";
+            DROP TABLE IF EXISTS "sentence_fts";
+            DROP TABLE IF EXISTS "audio_fts";
+            PRAGMA user_version = 0;
         """)
-        cur.close()
-        self.conn.commit()
+        self.migrate()
+
+    def migrate(self) -> int:
+        """
+        Upgrade the database in place to the latest schema version, returning the version.
+        Full-text indexes are skipped without FTS5 trigram support and built by a later call once SQLite has it,
+        so the versions after them still apply.
+        """
+        with self.pool.write_lock:
+            db_version = self.fetchone("PRAGMA user_version")[0]
+            for i in range(len(DB_MIGRATION)):
+                db_fts = "fts5" in DB_MIGRATION[i]
+                if i < db_version and not (db_fts and not self.has_fts()):
+                    continue
+                if db_fts and not self.fts_ready():
+                    print(f"Pickpod database skips the full-text indexes of version {i + 1}, SQLite {sqlite3.sqlite_version} lacks the FTS5 trigram tokenizer.")
+                    db_script = ""
+                else:
+                    db_script = DB_MIGRATION[i]
+                self.executescript(f"BEGIN;\n{db_script}\nPRAGMA user_version = {max(db_version, i + 1)};\nCOMMIT;")
+                if db_script:
+                    print(f"Pickpod database migrated to version {i + 1}." if i >= db_version else f"Pickpod database built the full-text indexes of version {i + 1}.")
+            return max(db_version, len(DB_MIGRATION))
+
+    def fts_ready(self) -> bool:
+        """
+        Check whether SQLite supports FTS5 with the trigram tokenizer
+        """
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE temp.fts_check USING fts5 (content, tokenize='trigram')")
+            self.conn.execute("DROP TABLE temp.fts_check")
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def has_fts(self) -> bool:
+        """
+        Check whether the full-text indexes exist
+        """
+        return bool(self.fetchone(*self.find_tb("sentence_fts"))[0] and self.fetchone(*self.find_tb("audio_fts"))[0])
 
     @staticmethod
     def find_tb(name_tb: str) -> (str, tuple):
         return "SELECT count(1) FROM sqlite_master WHERE type=? AND name=?", ("table", name_tb)
 
     def execute(self, sql: str = "", arg: tuple = tuple()) -> None:
-        cur = self.conn.cursor()
-        cur.execute(sql, arg)
-        print(f"Affected rows: {cur.rowcount}")
-        cur.close()
-        self.conn.commit()
+        with self.pool.write_lock:
+            cur = self.conn.cursor()
+            cur.execute(sql, arg)
+            if self.verbose:
+                print(f"Affected rows: {cur.rowcount}")
+            cur.close()
+            self.conn.commit()
+            if self.pool.cache:
+                self.pool.cache.invalidate(sql, arg)
+
+    def executescript(self, sql: str = "") -> None:
+        with self.pool.write_lock:
+            cur = self.conn.cursor()
+            cur.executescript(sql)
+            cur.close()
+            self.conn.commit()
+            if self.pool.cache:
+                self.pool.cache.clear()
+
+    @staticmethod
+    def group_sql(sql_list: List[Tuple[str, tuple]]) -> List[Tuple[str, List[tuple]]]:
+        """
+        Group (sql, arg) pairs by statement, keeping the order in which statements first appear
+        """
+        sql_group = dict()
+        for x, y in sql_list:
+            sql_group.setdefault(x, list()).append(y)
+        return list(sql_group.items())
+
+    def executemany(self, sql_list: List[Tuple[str, List[tuple]]]) -> int:
+        """
+        Execute (sql, arg list) pairs in one transaction, returning the number of affected rows
+        """
+        row_count = 0
+        with self.pool.write_lock, self.conn:
+            cur = self.conn.cursor()
+            for x, y in sql_list:
+                if y:
+                    cur.executemany(x, y)
+                    row_count += cur.rowcount
+            cur.close()
+        if self.pool.cache:
+            for x, y in sql_list:
+                for z in y:
+                    self.pool.cache.invalidate(x, z)
+        if self.verbose:
+            print(f"Affected rows: {row_count}")
+        return row_count
 
     def fetchone(self, sql: str = "", arg: tuple = tuple()) -> tuple:
+        if self.pool.cache and self.pool.cache.get_key(sql, arg):
+            obj = self.fetchall(sql, arg)
+            return obj[0] if obj else None
         cur = self.conn.cursor()
         cur.execute(sql, arg)
         obj = cur.fetchone()
@@ -157,12 +544,76 @@ class DBClient(object):
         return obj
 
     def fetchall(self, sql: str = "", arg: tuple = tuple()) -> tuple:
+        cache_version = 0
+        if self.pool.cache:
+            obj = self.pool.cache.get(sql, arg)
+            if obj is not None:
+                return obj
+            cache_version = self.pool.cache.version
         cur = self.conn.cursor()
         cur.execute(sql, arg)
         obj = cur.fetchall()
         cur.close()
         self.conn.commit()
+        if self.pool.cache:
+            self.pool.cache.put(sql, arg, obj, cache_version)
         return obj
 
+    def fetchall_chunk(self, sql_list: List[Tuple[str, tuple]]) -> list:
+        """
+        Fetch the rows of several chunked queries in order
+        """
+        return [y for x in sql_list for y in self.fetchall(*x)]
+
     def close(self) -> None:
-        self.conn.close()
+        """
+        Release the pooled connection of the current thread for reuse by other threads,
+        to be called before a worker or request thread ends
+        """
+        self.pool.release()
+
+
+class DBUnit(object):
+    """
+    Unit of work over drafts loaded from a pickpod database.
+    Registered drafts are snapshotted by their state(), and flush writes only the drafts whose state changed,
+    together with added and removed drafts, in one transaction.
+    Snapshots live in the unit rather than on the drafts, so that draft __dict__ exports stay unchanged.
+    """
+
+    def __init__(self, db_client: DBClient) -> None:
+        self.db_client = db_client
+        self.snapshot = dict()
+        self.insert = list()
+        self.delete = list()
+
+    def register(self, draft_list: list) -> list:
+        """
+        Track loaded drafts, returning them
+        """
+        for x in draft_list:
+            self.snapshot[(type(x).__name__, x.uuid)] = (x, x.state())
+        return draft_list
+
+    def add(self, draft: Any) -> None:
+        self.insert.append(draft)
+
+    def remove(self, draft: Any) -> None:
+        self.snapshot.pop((type(draft).__name__, draft.uuid), None)
+        self.delete.append(draft)
+
+    def dirty(self) -> list:
+        """
+        Get the registered drafts changed since they were loaded or flushed
+        """
+        return [x for x, y in self.snapshot.values() if x.state() != y]
+
+    def flush(self) -> int:
+        """
+        Write the changes in one transaction, returning the number of affected rows
+        """
+        sql_list = [x.insert() for x in self.insert] + [x.update() for x in self.dirty()] + [x.delete_status(x.uuid) for x in self.delete]
+        row_count = self.db_client.executemany(DBClient.group_sql(sql_list)) if sql_list else 0
+        self.register([x for x in self.insert] + [x for x, _ in self.snapshot.values()])
+        self.insert, self.delete = list(), list()
+        return row_count
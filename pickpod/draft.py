@@ -5,6 +5,30 @@ import time
 import uuid
 
 
+# Number of values bound in one IN (...) query
+SQL_CHUNK = 500
+
+
+def sql_chunk(value_list: list) -> list:
+    """
+    Split values into chunks for IN (...) queries
+    """
+    value_list = list(dict.fromkeys(value_list))
+    return [value_list[i:i + SQL_CHUNK] for i in range(0, len(value_list), SQL_CHUNK)]
+
+class CacheSQL(str):
+    """
+    SQL of a draft read which DBCache may cache, keyed by the uuid or audioId bound first
+    """
+
+
+def fts_phrase(text: str = "") -> str:
+    """
+    Quote text as an FTS5 phrase
+    """
+    return '"{}"'.format(text.replace('"', '""'))
+
+
 class SentenceDraft(object):
 
     def __init__(
@@ -32,17 +56,56 @@ class SentenceDraft(object):
     def insert(self) -> (str, tuple):
         return "INSERT INTO sentence (uuid, audioId, content, start, end, speaker, status, createTime, updateTime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (self.uuid, self.aid, self.content, self.start, self.end, self.speaker, self.status, self.ctime, int(time.time()))
 
+    @staticmethod
+    def insert_many(sentence_list: list) -> (str, list):
+        return SentenceDraft().insert()[0], [x.insert()[1] for x in sentence_list]
+
     def update(self) -> (str, tuple):
         return "UPDATE sentence SET content=?, start=?, end=?, speaker=?, updateTime=? WHERE uuid=?", (self.content, self.start, self.end, self.speaker, int(time.time()), self.uuid)
 
+    def state(self) -> tuple:
+        return (self.content, self.start, self.end, self.speaker)
+
     @staticmethod
     def select_by_aid(sentence_aid: str) -> (str, tuple):
-        return "SELECT uuid, audioId, content, start, end, speaker, status, createTime, updateTime FROM sentence WHERE audioId=? AND status=? ORDER BY start ASC", (sentence_aid, 1)
+        return CacheSQL("SELECT uuid, audioId, content, start, end, speaker, status, createTime, updateTime FROM sentence WHERE audioId=? AND status=? ORDER BY start ASC"), (sentence_aid, 1)
+
+    @staticmethod
+    def select_page(sentence_aid: str, page_start: float = -1.0, page_uuid: str = "", page_size: int = 50) -> (str, tuple):
+        """
+        Keyset page of sentences from (start, uuid) inclusive, with one extra row marking the next page
+        """
+        return CacheSQL("SELECT uuid, audioId, content, start, end, speaker, status, createTime, updateTime FROM sentence WHERE audioId=? AND status=? AND (start, uuid)>=(?, ?) ORDER BY start ASC, uuid ASC LIMIT ?"), (sentence_aid, 1, page_start, page_uuid, page_size + 1)
+
+    @staticmethod
+    def select_page_before(sentence_aid: str, page_start: float = -1.0, page_uuid: str = "", page_size: int = 50) -> (str, tuple):
+        """
+        Keyset page of sentences before (start, uuid), in descending order
+        """
+        return CacheSQL("SELECT uuid, audioId, content, start, end, speaker, status, createTime, updateTime FROM sentence WHERE audioId=? AND status=? AND (start, uuid)<(?, ?) ORDER BY start DESC, uuid DESC LIMIT ?"), (sentence_aid, 1, page_start, page_uuid, page_size)
+
+    @staticmethod
+    def select_sentences_by_aids(sentence_aids: list) -> list:
+        return [
+            (f"SELECT uuid, audioId, content, start, end, speaker, status, createTime, updateTime FROM sentence WHERE audioId IN ({', '.join(['?'] * len(x))}) AND status=? ORDER BY audioId ASC, start ASC", (*x, 1))
+            for x in sql_chunk(sentence_aids)
+            ]
+
+    @staticmethod
+    def group_by_aid(sentence_list: list) -> dict:
+        sentence_dict = dict()
+        for x in sentence_list:
+            sentence_dict.setdefault(x[1], list()).append(SentenceDraft.db_init(x))
+        return sentence_dict
 
     @staticmethod
     def select_by_content(sentence_content: str) -> (str, tuple):
         return "SELECT DISTINCT audioId FROM sentence WHERE content LIKE ? AND status=?", (f"%{sentence_content}%", 1)
 
+    @staticmethod
+    def search_by_content(sentence_content: str, time_min: int, time_max: int, limit: int = 100) -> (str, tuple):
+        return "SELECT sentence.audioId, audio.title, sentence.uuid, sentence.start, sentence.content FROM sentence_fts JOIN sentence ON sentence.id=sentence_fts.rowid JOIN audio ON audio.uuid=sentence.audioId WHERE sentence_fts MATCH ? AND sentence.status=1 AND audio.createTime>=? AND audio.createTime<? AND audio.status=1 ORDER BY sentence_fts.rank LIMIT ?", (fts_phrase(sentence_content), time_min, time_max, limit)
+
     @staticmethod
     def delete_status(sentence_uuid: str) -> (str, tuple):
         return "UPDATE sentence SET status=?, updateTime=? WHERE uuid=?", (0, int(time.time()), sentence_uuid)
@@ -76,12 +139,33 @@ class SummaryDraft(object):
     def insert(self) -> (str, tuple):
         return "INSERT INTO formation (uuid, audioId, content, mark, target, status, createTime, updateTime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (self.uuid, self.aid, self.content, self.start, self.target, self.status, self.ctime, int(time.time()))
 
+    @staticmethod
+    def insert_many(summary_list: list) -> (str, list):
+        return SummaryDraft().insert()[0], [x.insert()[1] for x in summary_list]
+
     def update(self) -> (str, tuple):
         return "UPDATE formation SET content=?, mark=?, updateTime=? WHERE uuid=?", (self.content, self.start, int(time.time()), self.uuid)
 
+    def state(self) -> tuple:
+        return (self.content, self.start)
+
     @staticmethod
     def select_by_aid(summary_aid: str) -> (str, tuple):
-        return "SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId=? AND target=? AND status=? ORDER BY mark ASC", (summary_aid, 0, 1)
+        return CacheSQL("SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId=? AND target=? AND status=? ORDER BY mark ASC"), (summary_aid, 0, 1)
+
+    @staticmethod
+    def select_formation_by_aids(summary_aids: list) -> list:
+        return [
+            (f"SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId IN ({', '.join(['?'] * len(x))}) AND target=? AND status=? ORDER BY audioId ASC, mark ASC", (*x, 0, 1))
+            for x in sql_chunk(summary_aids)
+            ]
+
+    @staticmethod
+    def group_by_aid(summary_list: list) -> dict:
+        summary_dict = dict()
+        for x in summary_list:
+            summary_dict.setdefault(x[1], list()).append(SummaryDraft.db_init(x))
+        return summary_dict
 
     @staticmethod
     def delete_status(summary_uuid: str) -> (str, tuple):
@@ -116,12 +200,33 @@ class ViewDraft(object):
     def insert(self) -> (str, tuple):
         return "INSERT INTO formation (uuid, audioId, content, mark, target, status, createTime, updateTime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (self.uuid, self.aid, self.content, self.value, self.target, self.status, self.ctime, int(time.time()))
 
+    @staticmethod
+    def insert_many(view_list: list) -> (str, list):
+        return ViewDraft().insert()[0], [x.insert()[1] for x in view_list]
+
     def update(self) -> (str, tuple):
         return "UPDATE formation SET content=?, mark=?, updateTime=? WHERE uuid=?", (self.content, self.value, int(time.time()), self.uuid)
 
+    def state(self) -> tuple:
+        return (self.content, self.value)
+
     @staticmethod
     def select_by_aid(view_aid: str) -> (str, tuple):
-        return "SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId=? AND target=? AND status=? ORDER BY createTime ASC", (view_aid, 1, 1)
+        return CacheSQL("SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId=? AND target=? AND status=? ORDER BY createTime ASC"), (view_aid, 1, 1)
+
+    @staticmethod
+    def select_formation_by_aids(view_aids: list) -> list:
+        return [
+            (f"SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId IN ({', '.join(['?'] * len(x))}) AND target=? AND status=? ORDER BY audioId ASC, createTime ASC", (*x, 1, 1))
+            for x in sql_chunk(view_aids)
+            ]
+
+    @staticmethod
+    def group_by_aid(view_list: list) -> dict:
+        view_dict = dict()
+        for x in view_list:
+            view_dict.setdefault(x[1], list()).append(ViewDraft.db_init(x))
+        return view_dict
 
     @staticmethod
     def delete_status(view_uuid: str) -> (str, tuple):
@@ -156,12 +261,19 @@ class WikiDraft(object):
     def insert(self) -> (str, tuple):
         return "INSERT INTO formation (uuid, audioId, content, mark, target, status, createTime, updateTime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (self.uuid, self.aid, self.content, self.value, self.target, self.status, self.ctime, int(time.time()))
 
+    @staticmethod
+    def insert_many(wiki_list: list) -> (str, list):
+        return WikiDraft().insert()[0], [x.insert()[1] for x in wiki_list]
+
     def update(self) -> (str, tuple):
         return "UPDATE formation SET content=?, mark=?, updateTime=? WHERE uuid=?", (self.content, self.value, int(time.time()), self.uuid)
 
+    def state(self) -> tuple:
+        return (self.content, self.value)
+
     @staticmethod
     def select_by_aid(wiki_aid: str) -> (str, tuple):
-        return "SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId=? AND target=? AND status=? ORDER BY createTime ASC", (wiki_aid, 2, 1)
+        return CacheSQL("SELECT uuid, audioId, content, mark, status, createTime, updateTime FROM formation WHERE audioId=? AND target=? AND status=? ORDER BY createTime ASC"), (wiki_aid, 2, 1)
 
     @staticmethod
     def delete_status(wiki_uuid: str) -> (str, tuple):
@@ -217,12 +329,30 @@ class AudioDraft(object):
     def insert(self) -> (str, tuple):
         return "INSERT INTO audio (uuid, title, ext, web, url, duration, language, description, keyword, path, origin, status, createTime, updateTime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (self.uuid, self.title, self.ext, self.web, self.url, self.duration, self.language, self.description, self.keyword, self.path, self.origin, self.status, self.ctime, int(time.time()))
 
+    @staticmethod
+    def insert_many(audio_list: list) -> (str, list):
+        return AudioDraft().insert()[0], [x.insert()[1] for x in audio_list]
+
     def update(self) -> (str, tuple):
         return "UPDATE audio SET title=?, web=?, url=?, language=?, description=?, keyword=?, origin=?, updateTime=? WHERE uuid=?", (self.title, self.web, self.url, self.language, self.description, self.keyword, self.origin, int(time.time()), self.uuid)
 
+    def state(self) -> tuple:
+        return (self.title, self.web, self.url, self.language, self.description, self.keyword, self.origin)
+
     @staticmethod
     def select_by_uuid(audio_uuid: str) -> (str, tuple):
-        return "SELECT uuid, title, ext, web, url, duration, language, description, keyword, path, origin, status, createTime, updateTime FROM audio WHERE uuid=? AND status=? LIMIT 1", (audio_uuid, 1)
+        return CacheSQL("SELECT uuid, title, ext, web, url, duration, language, description, keyword, path, origin, status, createTime, updateTime FROM audio WHERE uuid=? AND status=? LIMIT 1"), (audio_uuid, 1)
+
+    @staticmethod
+    def select_by_uuids(audio_uuids: list) -> list:
+        return [
+            (f"SELECT uuid, title, ext, web, url, duration, language, description, keyword, path, origin, status, createTime, updateTime FROM audio WHERE uuid IN ({', '.join(['?'] * len(x))}) AND status=?", (*x, 1))
+            for x in sql_chunk(audio_uuids)
+            ]
+
+    @staticmethod
+    def group_by_uuid(audio_list: list) -> dict:
+        return {x[0]: AudioDraft.db_init(x) for x in audio_list}
 
     @staticmethod
     def delete_status(audio_uuid: str) -> (str, tuple):
@@ -256,6 +386,14 @@ class AudioDraft(object):
     def select_keyword_uuid(audio_keyword: str, time_min: int, time_max: int) -> (str, tuple):
         return "SELECT uuid, origin, createTime FROM audio WHERE keyword LIKE ? AND createTime>=? AND createTime<? AND status=1", (f"%{audio_keyword}%", time_min, time_max)
 
+    @staticmethod
+    def search_uuid(audio_q: str, audio_field: list, time_min: int, time_max: int) -> (str, tuple):
+        return "SELECT audio.uuid, audio.origin, audio.createTime FROM audio_fts JOIN audio ON audio.id=audio_fts.rowid WHERE audio_fts MATCH ? AND audio.createTime>=? AND audio.createTime<? AND audio.status=1 ORDER BY audio_fts.rank", ("{{{}}} : {}".format(" ".join(audio_field), fts_phrase(audio_q)), time_min, time_max)
+
+    @staticmethod
+    def search_sentence_uuid(audio_q: str, time_min: int, time_max: int) -> (str, tuple):
+        return "SELECT audio.uuid, audio.origin, audio.createTime FROM (SELECT rowid, rank FROM sentence_fts WHERE sentence_fts MATCH ?) AS hit JOIN sentence ON sentence.id=hit.rowid JOIN audio ON audio.uuid=sentence.audioId WHERE sentence.status=1 AND audio.createTime>=? AND audio.createTime<? AND audio.status=1 GROUP BY audio.uuid ORDER BY min(hit.rank)", (fts_phrase(audio_q), time_min, time_max)
+
     @staticmethod
     def select_sentence_uuid(audio_uuid: str, time_min: int, time_max: int) -> (str, tuple):
         return "SELECT uuid, origin, createTime FROM audio WHERE uuid=? AND createTime>=? AND createTime<? AND status=1 LIMIT 1", (audio_uuid, time_min, time_max)
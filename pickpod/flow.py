@@ -0,0 +1,109 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+
+class PickpodStage(object):
+    """
+    A stage of a pickpod flow.
+    The stage function receives an emit callback to stream partial results,
+    and runs once all stages in depend have succeeded and all stages in after have finished.
+    """
+
+    def __init__(
+            self,
+            stage_name: str = "", # Stage name
+            stage_func: Callable[[Callable[[Any], None]], Any] = None, # Stage function
+            stage_depend: List[str] = None, # Stages which must succeed before this stage
+            stage_after: List[str] = None # Stages which must finish (in any state) before this stage
+            ) -> None:
+        self.name = stage_name
+        self.func = stage_func
+        self.depend = stage_depend if stage_depend else list()
+        self.after = stage_after if stage_after else list()
+
+
+class PickpodFlow(object):
+    """
+    A small DAG orchestrator for pickpod stages.
+    Independent stages run concurrently, the timing of every stage is recorded,
+    and events (stage, state, payload) are streamed to the caller,
+    where state is one of "start", "partial", "done", "skip" and "fail".
+    Dependencies on stages outside the flow are treated as satisfied.
+    """
+
+    def __init__(self, stage_list: List[PickpodStage], max_workers: int = 4) -> None:
+        self.stage = {x.name: x for x in stage_list}
+        self.max_workers = max(max_workers, 1)
+        self.state = dict()
+        self.result = dict()
+        self.error = dict()
+        self.timing = dict()
+        self.event = Queue()
+
+    def stage_run(self, stage: PickpodStage) -> None:
+        self.event.put((stage.name, "start", None))
+        start_time = time.time()
+        try:
+            stage_result = stage.func(lambda x: self.event.put((stage.name, "partial", x)))
+            self.timing[stage.name] = time.time() - start_time
+            self.event.put((stage.name, "done", stage_result))
+        except Exception as e:
+            self.timing[stage.name] = time.time() - start_time
+            self.event.put((stage.name, "fail", e))
+
+    def stage_ready(self, stage: PickpodStage) -> bool:
+        return all([
+            self.state.get(x) in ("done", "skip", "fail")
+            for x in stage.depend + stage.after if x in self.stage
+            ])
+
+    def stream(self) -> Iterator[Tuple[str, str, Any]]:
+        """
+        Run the flow and yield its events
+        """
+        stage_pending = list(self.stage.values())
+        stage_running = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while stage_pending or stage_running:
+                while [x for x in stage_pending if self.stage_ready(x)]:
+                    stage = [x for x in stage_pending if self.stage_ready(x)][0]
+                    stage_pending.remove(stage)
+                    if any([self.state.get(x) != "done" for x in stage.depend if x in self.stage]):
+                        self.state[stage.name] = "skip"
+                        yield stage.name, "skip", None
+                        continue
+                    self.state[stage.name] = "run"
+                    stage_running += 1
+                    executor.submit(self.stage_run, stage)
+                if not stage_running:
+                    if stage_pending:
+                        raise ValueError(f"Pickpod flow has a dependency cycle: {[x.name for x in stage_pending]}")
+                    break
+                stage_name, stage_state, stage_payload = self.event.get()
+                if stage_state == "done":
+                    self.result[stage_name] = stage_payload
+                elif stage_state == "fail":
+                    self.error[stage_name] = stage_payload
+                if stage_state in ("done", "fail"):
+                    self.state[stage_name] = stage_state
+                    stage_running -= 1
+                yield stage_name, stage_state, stage_payload
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run the flow to the end and raise the first failure
+        """
+        for stage_name, stage_state, _ in self.stream():
+            if stage_state == "done":
+                print(f"The stage \"{stage_name}\" is done, using time: {self.timing[stage_name]} s")
+            elif stage_state == "skip":
+                print(f"The stage \"{stage_name}\" has skipped.")
+        for stage_name, stage_error in self.error.items():
+            print(f"The stage \"{stage_name}\" failed.")
+            raise stage_error
+        return self.result
@@ -0,0 +1,271 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import shutil
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import parse_qs, quote, urlparse
+
+from pickpod.config import DBClient
+from pickpod.draft import AudioDraft
+
+
+# Bytes copied per write when streaming a clip
+MEDIA_CHUNK = 64 * 1024
+
+# Longest clip in seconds returned by the clip endpoint
+CLIP_MAX = 600
+
+# Content type of each audio extension
+MEDIA_TYPE = {
+    "m4a": "audio/mp4",
+    "mp4": "audio/mp4",
+    "aac": "audio/aac",
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "ogg": "audio/ogg",
+    "opus": "audio/ogg",
+    "webm": "audio/webm"
+}
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the pickpod media server.
+    GET /audio/<uuid> serves a stored episode with HTTP Range support (?download=<name> as an attachment),
+    and GET /clip/<uuid>?start=&end= streams the segment between two timestamps as MP3 through ffmpeg.
+    Only files recorded in the audio table are served, and only to URLs signed by the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def get_query(self, query_name: str, query_default: str = "") -> str:
+        return parse_qs(urlparse(self.path).query).get(query_name, [query_default])[0]
+
+    def get_audio(self, audio_uuid: str) -> AudioDraft:
+        audio_row = self.server.db_client.fetchone(*AudioDraft.select_by_uuid(audio_uuid))
+        audio_draft = AudioDraft.db_init(audio_row) if audio_row else None
+        return audio_draft if audio_draft and os.path.isfile(audio_draft.path) else None
+
+    @staticmethod
+    def get_range(range_header: str, file_size: int) -> Tuple[int, int]:
+        """
+        Parse the first range of a Range header into inclusive byte offsets,
+        returning None without a valid header and raising ValueError if it is not satisfiable
+        """
+        range_match = re.match(r"^bytes=\s*(\d*)-(\d*)", range_header or "")
+        if not range_match or not (range_match.group(1) or range_match.group(2)):
+            return None
+        if not range_match.group(1):
+            range_start, range_end = max(file_size - int(range_match.group(2)), 0), file_size - 1
+        else:
+            range_start = int(range_match.group(1))
+            range_end = min(int(range_match.group(2)), file_size - 1) if range_match.group(2) else file_size - 1
+        if range_start >= file_size or range_start > range_end:
+            raise ValueError("Range not satisfiable", range_header)
+        return range_start, range_end
+
+    def send_audio(self, audio_uuid: str, head_only: bool = False) -> None:
+        audio_draft = self.get_audio(audio_uuid)
+        if audio_draft is None:
+            self.send_error(404, "Audio not found")
+            return
+        file_size = os.path.getsize(audio_draft.path)
+        try:
+            byte_range = self.get_range(self.headers.get("Range"), file_size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{file_size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        range_start, range_end = byte_range if byte_range else (0, file_size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", MEDIA_TYPE.get(audio_draft.ext.lower(), "application/octet-stream"))
+        self.send_header("Content-Length", str(range_end - range_start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Cache-Control", "private, max-age=86400")
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {range_start}-{range_end}/{file_size}")
+        audio_name = self.get_query("download")
+        if audio_name:
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(os.path.basename(audio_name))}")
+        self.end_headers()
+        if head_only or range_end < range_start:
+            return
+        with open(audio_draft.path, "rb") as f:
+            self.connection.sendfile(f, range_start, range_end - range_start + 1)
+
+    def send_clip(self, audio_uuid: str, head_only: bool = False) -> None:
+        audio_draft = self.get_audio(audio_uuid)
+        if audio_draft is None:
+            self.send_error(404, "Audio not found")
+            return
+        try:
+            clip_start = float(self.get_query("start", "0"))
+            clip_end = float(self.get_query("end", str(clip_start + 30)))
+        except ValueError:
+            self.send_error(400, "Invalid clip range")
+            return
+        if clip_start < 0 or clip_end <= clip_start or clip_end - clip_start > CLIP_MAX:
+            self.send_error(400, f"Clip must be within 0 to {CLIP_MAX} seconds long")
+            return
+        if head_only:
+            self.send_clip_header()
+            return
+        if not self.server.clip_semaphore.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            try:
+                clip_process = subprocess.Popen(
+                    ["ffmpeg", "-v", "error", "-ss", str(clip_start), "-t", str(clip_end - clip_start), "-i", audio_draft.path, "-vn", "-f", "mp3", "pipe:1"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                    )
+            except OSError as e:
+                print("Clip encoding failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+                self.send_error(500, "Clip encoding failed")
+                return
+            try:
+                self.send_clip_header()
+                shutil.copyfileobj(clip_process.stdout, self.wfile, MEDIA_CHUNK)
+            finally:
+                clip_process.kill()
+                clip_process.wait()
+        finally:
+            self.server.clip_semaphore.release()
+
+    def send_clip_header(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Cache-Control", "private, max-age=86400")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def route(self, head_only: bool = False) -> None:
+        route_match = re.match(r"^/(audio|clip)/([\w\-]+)$", urlparse(self.path).path)
+        if not route_match:
+            self.send_error(404)
+            return
+        if not hmac.compare_digest(self.get_query("token").encode("utf-8"), self.server.get_token(route_match.group(2)).encode("utf-8")):
+            self.send_error(403)
+            return
+        try:
+            if route_match.group(1) == "audio":
+                self.send_audio(route_match.group(2), head_only)
+            else:
+                self.send_clip(route_match.group(2), head_only)
+        except (BrokenPipeError, ConnectionResetError):
+            # The browser drops its previous request when seeking
+            self.close_connection = True
+
+    def finish(self) -> None:
+        super().finish()
+        self.server.db_client.close()
+
+    def do_GET(self) -> None:
+        self.route()
+
+    def do_HEAD(self) -> None:
+        self.route(head_only=True)
+
+
+class PickpodMedia(object):
+    """
+    Threaded HTTP server streaming stored audio to the browser.
+    Files are sent straight from disk with sendfile, so memory per viewer stays near zero,
+    and Range requests let players seek to a timestamp without downloading the whole episode.
+    URLs carry a token signed with a per-process secret, so only pages rendered by the app can fetch audio,
+    and at most max_clip ffmpeg processes run at once.
+    """
+
+    media_dict = dict()
+    media_lock = threading.Lock()
+
+    def __init__(
+            self,
+            path_db: str = "", # Folder of the pickpod database
+            media_host: str = "127.0.0.1", # Host to listen on, "" for all interfaces
+            media_port: int = 8052, # Port to listen on
+            max_clip: int = 2 # Concurrent clip encodings
+            ) -> None:
+        self.path_db = path_db
+        self.host = media_host
+        self.port = media_port
+        self.max_clip = max(max_clip, 1)
+        self.secret = secrets.token_bytes(32)
+        self.server = None
+        self.thread = None
+
+    @classmethod
+    def get_media(cls, path_db: str = "", media_host: str = "127.0.0.1", media_port: int = 8052) -> object:
+        """
+        Get the started server of an address, shared by every module of the process so that URLs carry its token
+        """
+        with cls.media_lock:
+            if (media_host, media_port) not in cls.media_dict:
+                pickpod_media = PickpodMedia(path_db, media_host, media_port).start()
+                if pickpod_media.server is None:
+                    return pickpod_media
+                cls.media_dict[(media_host, media_port)] = pickpod_media
+            return cls.media_dict[(media_host, media_port)]
+
+    def get_token(self, audio_uuid: str) -> str:
+        return hmac.new(self.secret, audio_uuid.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+    def start(self) -> object:
+        """
+        Start serving in a background thread, returning the server itself
+        """
+        if self.server is None:
+            try:
+                self.server = ThreadingHTTPServer((self.host, self.port), MediaHandler)
+            except OSError as e:
+                print("Media server failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+                return self
+            self.port = self.server.server_address[1]
+            self.server.daemon_threads = True
+            self.server.db_client = DBClient(self.path_db, verbose=False)
+            self.server.clip_semaphore = threading.BoundedSemaphore(self.max_clip)
+            self.server.get_token = self.get_token
+            self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+            self.thread.start()
+            print(f"Pickpod media server is listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self) -> None:
+        with PickpodMedia.media_lock:
+            for x in [x for x, y in PickpodMedia.media_dict.items() if y is self]:
+                del PickpodMedia.media_dict[x]
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def get_audio_url(self, media_url: str, audio_uuid: str, audio_name: str = "") -> str:
+        """
+        Get the signed URL of an episode under the base URL seen by the browser, downloaded as audio_name if given
+        """
+        return f"{media_url.rstrip('/')}/audio/{audio_uuid}?token={self.get_token(audio_uuid)}" + (f"&download={quote(audio_name)}" if audio_name else "")
+
+    def get_clip_url(self, media_url: str, audio_uuid: str, clip_start: float = 0.0, clip_end: float = 30.0) -> str:
+        """
+        Get the signed URL of the segment of an episode between two timestamps in seconds
+        """
+        return f"{media_url.rstrip('/')}/clip/{audio_uuid}?token={self.get_token(audio_uuid)}&start={round(clip_start, 2)}&end={round(clip_end, 2)}"
@@ -0,0 +1,180 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import gc
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import torch
+from faster_whisper import WhisperModel
+from pyannote.audio import Pipeline
+
+
+# Approximate float32 weight size of faster_whisper models in MB
+WHISPER_SIZE = {
+    "tiny": 150,
+    "base": 290,
+    "small": 970,
+    "medium": 3060,
+    "large": 6170,
+    "distil-small": 660,
+    "distil-medium": 1580,
+    "distil-large": 3030
+}
+
+# Weight size scale of each compute type relative to float32
+WHISPER_SCALE = {
+    "float32": 1.0,
+    "float16": 0.5,
+    "bfloat16": 0.5,
+    "int8_float32": 0.25,
+    "int8_float16": 0.25,
+    "int8_bfloat16": 0.25,
+    "int8": 0.25
+}
+
+# Default pyannote speaker diarization checkpoint
+PYANNOTE_CHECKPOINT = "pyannote/speaker-diarization-3.0"
+
+
+class WhisperRegistry(object):
+    """
+    Process-wide registry of loaded faster_whisper models.
+    Models are keyed by (model name, device, compute type, threads),
+    and the least recently used ones are evicted under the memory budget (MB).
+    """
+
+    memory_budget = int(os.getenv("PICKPOD_WHISPER_MEMORY", 8192))
+    model_dict = OrderedDict()
+    model_lock = threading.RLock()
+
+    @staticmethod
+    def get_size(model_file: str, compute_type: str) -> int:
+        """
+        Estimate the memory size of a model
+        """
+        model_bin = os.path.join(model_file, "model.bin")
+        if os.path.isfile(model_bin):
+            return os.path.getsize(model_bin) // (1024 * 1024)
+        model_name = os.path.basename(model_file.rstrip("/")).replace("faster-whisper-", "")
+        model_size = WHISPER_SIZE["large"]
+        for x, y in WHISPER_SIZE.items():
+            if model_name.startswith(x):
+                model_size = y
+        return int(model_size * WHISPER_SCALE.get(compute_type, 1.0))
+
+    @classmethod
+    def get_model(cls, model_file: str = "large-v3", device: str = "cpu", compute_type: str = "int8", cpu_threads: int = 0) -> WhisperModel:
+        """
+        Get a loaded model, loading it if necessary
+        """
+        model_key = (model_file, device, compute_type, cpu_threads)
+        with cls.model_lock:
+            if model_key in cls.model_dict:
+                cls.model_dict.move_to_end(model_key)
+                return cls.model_dict[model_key][0]
+            model_size = cls.get_size(model_file, compute_type)
+            cls.evict(model_size)
+            print(f"Loading whisper model \"{model_file}\" on {device} ({compute_type}, {cpu_threads} threads)")
+            whisper_model = WhisperModel(model_file, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+            cls.model_dict[model_key] = (whisper_model, model_size)
+            return whisper_model
+
+    @classmethod
+    def warm_up(cls, model_file: str = "large-v3", device: str = "cpu", compute_type: str = "int8", cpu_threads: int = 0) -> None:
+        """
+        Load a model in advance
+        """
+        cls.get_model(model_file, device, compute_type, cpu_threads)
+
+    @classmethod
+    def evict(cls, model_size: int = 0) -> None:
+        """
+        Drop the least recently used models until the new one fits in the budget
+        """
+        with cls.model_lock:
+            while cls.model_dict and sum([x[1] for x in cls.model_dict.values()]) + model_size > cls.memory_budget:
+                model_key, _ = cls.model_dict.popitem(last=False)
+                print(f"Unloading whisper model \"{model_key[0]}\" on {model_key[1]}")
+            gc.collect()
+
+    @classmethod
+    def unload(cls) -> None:
+        """
+        Unload all models
+        """
+        with cls.model_lock:
+            cls.model_dict.clear()
+            gc.collect()
+
+    @classmethod
+    def status(cls) -> Dict[Tuple[str, str, str, int], int]:
+        """
+        Get the loaded models with their estimated sizes
+        """
+        with cls.model_lock:
+            return {x: y[1] for x, y in cls.model_dict.items()}
+
+
+class PyannoteRegistry(object):
+    """
+    Process-wide cache of pyannote speaker diarization pipelines shared by all tasks.
+    A local checkpoint directory (containing config.yaml) is loaded without touching the network.
+    """
+
+    pipeline_dict = dict()
+    pipeline_lock = threading.RLock()
+
+    @staticmethod
+    def get_checkpoint(path_pyannote: str = "") -> str:
+        """
+        Resolve the checkpoint to load
+        """
+        if not path_pyannote:
+            return PYANNOTE_CHECKPOINT
+        if os.path.isdir(path_pyannote):
+            return os.path.join(os.path.abspath(path_pyannote), "config.yaml")
+        return os.path.abspath(path_pyannote)
+
+    @classmethod
+    def get_pipeline(cls, key_hugging_face: str = "", path_pyannote: str = "") -> Pipeline:
+        """
+        Get a loaded pipeline, loading it if necessary
+        """
+        pyannote_checkpoint = cls.get_checkpoint(path_pyannote)
+        pyannote_device = "cuda" if torch.cuda.is_available() else "cpu"
+        pipeline_key = (pyannote_checkpoint, pyannote_device)
+        with cls.pipeline_lock:
+            if pipeline_key in cls.pipeline_dict:
+                return cls.pipeline_dict[pipeline_key]
+            print(f"Loading pyannote pipeline \"{pyannote_checkpoint}\" on {pyannote_device}")
+            if path_pyannote:
+                pyannote_pipeline = Pipeline.from_pretrained(pyannote_checkpoint)
+            else:
+                pyannote_pipeline = Pipeline.from_pretrained(pyannote_checkpoint, use_auth_token=key_hugging_face)
+            if pyannote_device == "cuda":
+                try:
+                    pyannote_pipeline.to(torch.device("cuda"))
+                except Exception as e:
+                    pyannote_pipeline.to(torch.device("cpu"))
+                    print("CUDA pyannote failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+            cls.pipeline_dict[pipeline_key] = pyannote_pipeline
+            return pyannote_pipeline
+
+    @classmethod
+    def warm_up(cls, key_hugging_face: str = "", path_pyannote: str = "") -> None:
+        """
+        Load a pipeline in advance
+        """
+        cls.get_pipeline(key_hugging_face, path_pyannote)
+
+    @classmethod
+    def unload(cls) -> None:
+        """
+        Unload all pipelines
+        """
+        with cls.pipeline_lock:
+            cls.pipeline_dict.clear()
+            gc.collect()
@@ -0,0 +1,190 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:
+    jieba = None
+
+from pickpod.config import DBClient
+
+
+# Common English words ignored by the tokenizer
+STOPWORD_EN = set("""
+a about above after again against all also am an and any are aren't as at be because been before being below between both
+but by can can't could couldn't did didn't do does doesn't doing don't down during each few for from further get got had
+hadn't has hasn't have haven't having he he'd he'll he's her here here's hers herself him himself his how how's i i'd i'll
+i'm i've if in into is isn't it it's its itself just know let's like me more most mustn't my myself no nor not now of off
+on once one only or other ought our ours ourselves out over own really right same say shan't she she'd she'll she's should
+shouldn't so some such than that that's the their theirs them themselves then there there's these they they'd they'll
+they're they've thing think this those through to too um uh under until up very was wasn't we we'd we'll we're we've were
+weren't what what's when when's where where's which while who who's whom why why's will with won't would wouldn't yeah yes
+you you'd you'll you're you've your yours yourself yourselves
+""".split())
+
+# Common Chinese words ignored by the tokenizer
+STOPWORD_ZH = set("""
+的 了 是 在 我 你 他 她 它 我们 你们 他们 这 那 这个 那个 就 也 都 和 与 及 而 但 但是 所以 因为 如果 一个 一些 没有 不是 什么 怎么
+还是 就是 然后 其实 可能 可以 觉得 知道 这样 那么 还 又 很 吧 吗 呢 啊 嗯 哦 对 说 会 要 有 不 人 上 下 中 里 到 去 来 让 被 把 给
+""".split())
+
+
+class PickpodRank(object):
+    """
+    Local BM25 index over episode documents.
+    Chinese text is segmented with jieba when installed and falls back to character bigrams,
+    so that episodes can be scored against wiki views without any Claude request.
+    """
+
+    def __init__(
+            self,
+            doc_dict: Dict[str, str], # Document text by audio UUID
+            bm25_k1: float = 1.5, # Term frequency saturation
+            bm25_b: float = 0.75 # Document length normalization
+            ) -> None:
+        self.k1 = bm25_k1
+        self.b = bm25_b
+        self.tf = {x: Counter(self.get_token(y)) for x, y in doc_dict.items()}
+        self.length = {x: sum(y.values()) for x, y in self.tf.items()}
+        self.average = sum(self.length.values()) / max(len(self.length), 1)
+        self.df = Counter([z for y in self.tf.values() for z in y])
+        self.idf = {x: math.log(1 + (len(self.tf) - y + 0.5) / (y + 0.5)) for x, y in self.df.items()}
+
+    @staticmethod
+    def get_token(text: str = "") -> List[str]:
+        """
+        Split text into lowercase words without stopwords
+        """
+        token_list = list()
+        for x in re.findall(r"[一-鿿]+|[a-z0-9][a-z0-9'\-]*", text.lower()):
+            if not re.match(r"[一-鿿]", x):
+                token_list.append(x)
+            elif jieba:
+                token_list.extend(jieba.lcut(x))
+            elif len(x) == 1:
+                token_list.append(x)
+            else:
+                token_list.extend([x[i:i + 2] for i in range(len(x) - 1)])
+        return [x for x in token_list if x not in STOPWORD_EN and x not in STOPWORD_ZH and (len(x) > 1 or re.match(r"[一-鿿]", x))]
+
+    def get_score(self, query: str = "") -> Dict[str, float]:
+        """
+        Get BM25 scores of every document for a query
+        """
+        query_token = Counter(self.get_token(query))
+        rank_score = dict()
+        for x, y in self.tf.items():
+            rank_norm = self.k1 * (1 - self.b + self.b * self.length[x] / max(self.average, 1))
+            rank_score[x] = sum([
+                self.idf[z] * y[z] * (self.k1 + 1) / (y[z] + rank_norm) * w
+                for z, w in query_token.items() if z in y
+                ])
+        return rank_score
+
+    def get_novelty(self) -> Dict[str, float]:
+        """
+        Get the mean IDF of every document, favoring documents with rare words
+        """
+        return {x: sum([self.idf[z] * w for z, w in y.items()]) / max(self.length[x], 1) for x, y in self.tf.items()}
+
+    def get_rank(self, view_dict: Dict[bool, List[str]] = None, top_k: int = 0) -> List[str]:
+        """
+        Rank documents by their mean score against liked views minus disliked views,
+        or by novelty without any view, returning the top_k audio UUIDs (all for 0)
+        """
+        view_dict = view_dict if view_dict else dict()
+        if view_dict.get(True) or view_dict.get(False):
+            rank_score = {x: 0.0 for x in self.tf}
+            for view_value, view_sign in ((True, 1.0), (False, -1.0)):
+                for view_content in view_dict.get(view_value, list()):
+                    for x, y in self.get_score(view_content).items():
+                        rank_score[x] += view_sign * y / len(view_dict[view_value])
+        else:
+            rank_score = self.get_novelty()
+        rank_list = sorted(self.tf, key=lambda x: rank_score[x], reverse=True)
+        return rank_list[:top_k] if top_k else rank_list
+
+    @staticmethod
+    def get_brief(view_list: List[str], summary_list: List[str], sentence_text: str = "", max_char: int = 1500) -> str:
+        """
+        Compress an episode into its views and summaries for a recommendation prompt,
+        using the beginning of its transcript when neither exists
+        """
+        if not view_list and not summary_list:
+            return sentence_text[:max_char]
+        return "观点：{}；摘要：{}".format("；".join(view_list), "；".join(summary_list))[:max_char]
+
+
+class PickpodKeyword(object):
+    """
+    Local TF-IDF keyword extractor working without any network request.
+    Document frequencies are kept in the database next to the transcripts,
+    and only episodes not counted yet are added to them on each refresh.
+    """
+
+    idf_lock = threading.Lock()
+    idf_table = dict()
+
+    def __init__(self, path_db: str = "") -> None:
+        self.path_db = os.path.abspath(path_db)
+
+    @staticmethod
+    def select_new_aid() -> (str, tuple):
+        return "SELECT DISTINCT audioId FROM sentence WHERE status=? AND audioId NOT IN (SELECT audioId FROM idf_audio)", (1,)
+
+    @staticmethod
+    def select_sentence(audio_id: str) -> (str, tuple):
+        return "SELECT content FROM sentence WHERE audioId=? AND status=?", (audio_id, 1)
+
+    @staticmethod
+    def upsert_df() -> str:
+        return "INSERT INTO idf (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df=df+1"
+
+    @staticmethod
+    def insert_aid() -> str:
+        return "INSERT OR IGNORE INTO idf_audio (audioId) VALUES (?)"
+
+    def refresh(self) -> int:
+        """
+        Count the episodes added since the last refresh, returning their number.
+        The table is shared by all extractors of the same database in the process.
+        """
+        db_client = DBClient(self.path_db, verbose=False)
+        try:
+            with PickpodKeyword.idf_lock:
+                db_client.migrate()
+                if self.path_db not in PickpodKeyword.idf_table:
+                    PickpodKeyword.idf_table[self.path_db] = (
+                        Counter(dict(db_client.fetchall("SELECT term, df FROM idf"))),
+                        [db_client.fetchone("SELECT count(1) FROM idf_audio")[0]]
+                        )
+                idf_df, idf_num = PickpodKeyword.idf_table[self.path_db]
+                audio_new = [x[0] for x in db_client.fetchall(*self.select_new_aid())]
+                for audio_id in audio_new:
+                    term_set = set(PickpodRank.get_token(" ".join([x[0] for x in db_client.fetchall(*self.select_sentence(audio_id))])))
+                    db_client.executemany([(self.upsert_df(), [(x,) for x in term_set]), (self.insert_aid(), [(audio_id,)])])
+                    idf_df.update(term_set)
+                    idf_num[0] += 1
+            return len(audio_new)
+        finally:
+            db_client.close()
+
+    def get_keyword(self, text: str = "", top_k: int = 10) -> List[str]:
+        """
+        Get the top_k words of a text by TF-IDF
+        """
+        idf_df, idf_num = PickpodKeyword.idf_table.get(self.path_db, (Counter(), [0]))
+        term_count = Counter([x for x in PickpodRank.get_token(text) if len(x) > 1 and not re.match(r"^[\d\-']+$", x)])
+        term_score = {
+            x: y * (math.log((idf_num[0] + 1) / (idf_df[x] + 1)) + 1)
+            for x, y in term_count.items()
+            }
+        return sorted(term_score, key=lambda x: term_score[x], reverse=True)[:top_k]
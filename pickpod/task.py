@@ -3,18 +3,25 @@
 
 import json
 import os
-import time
 from copy import deepcopy
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 
-from pydub import AudioSegment
-
-from pickpod.api import ClaudeClient, s2t
+from pickpod.api import ClaudeCache, ClaudeClient, s2t
 from pickpod.config import DBClient, TaskConfig
 from pickpod.draft import AudioDraft, SentenceDraft, SummaryDraft, ViewDraft
+from pickpod.flow import PickpodFlow, PickpodStage
+from pickpod.rank import PickpodKeyword
 from pickpod.utils import PickpodUtils
 
 
+# Stages of a pickpod task running locally (decoding, transcription, speaker diarization)
+STAGE_LOCAL = ["decode", "transcribe", "diarize", "align"]
+# Stages of a pickpod task calling Claude
+STAGE_REMOTE = ["combine", "keyword", "summary", "view"]
+# Stages of a pickpod task on an audio file already stored locally
+STAGE_TASK = STAGE_LOCAL + STAGE_REMOTE
+
+
 class PickpodTask(object):
 
     def __init__(self, audio_draft: AudioDraft, task_config: TaskConfig) -> None:
@@ -23,24 +30,26 @@ class PickpodTask(object):
         self.sentence_draft = list()
         self.sentence_pipeline = list()
         self.sentence_text = ""
+        self.audio_buffer = None
+        self.thread_whisper = self.task_config.thread_whisper
+        self.thread_pyannote = self.task_config.thread_pyannote
+        self.task_language = self.task_config.language
         self.summary_draft = list()
         self.view_draft = list()
-        self.claude_client = ClaudeClient(key_claude=self.task_config.claude, http_proxy=self.task_config.proxy)
+        self.claude_combine = dict()
+        self.claude_client = ClaudeClient(
+            key_claude=self.task_config.claude,
+            http_proxy=self.task_config.proxy,
+            claude_cache=ClaudeCache.get_cache(self.task_config.path_db) if self.task_config.claude_cache else None
+            )
 
     def pickpod_with_url(self) -> None:
         try:
-            start_time = time.time()
-            if not self.task_config.ydl_option.get("outtmpl"):
-                self.task_config.ydl_option["outtmpl"] = f"{self.task_config.path_wav}/{self.audio_draft.uuid}.%(ext)s"
-            if not self.task_config.ydl_option.get("proxy") and self.task_config.proxy:
-                self.task_config.ydl_option["proxy"] = self.task_config.proxy
-            PickpodUtils.pickpod_ytdlp(self.audio_draft, self.task_config.ydl_option)
-            print(f"The downloading is done, using time: {time.time() - start_time} s")
-
-            self.pickpod_all_task()
+            self.pickpod_flow(["download"] + STAGE_TASK).run()
         except Exception as e:
             print("Pickpod task failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
         finally:
+            self.audio_buffer = None
             print("Pickpod task completed.")
 
     def pickpod_with_local(self) -> None:
@@ -49,7 +58,7 @@ class PickpodTask(object):
             audio_title, audio_ext = os.path.splitext(os.path.basename(self.audio_draft.path))
             self.audio_draft.title = audio_title
             self.audio_draft.ext = audio_ext[1:]
-            self.audio_draft.duration = len(AudioSegment.from_file(self.audio_draft.path)) / 1000
+            self.audio_draft.duration = PickpodUtils.get_duration(self.audio_draft.path)
 
             self.pickpod_all_task()
         except Exception as e:
@@ -58,72 +67,149 @@ class PickpodTask(object):
             print("Pickpod task completed.")
 
     def pickpod_all_task(self) -> None:
-        start_time = time.time()
-        _ = PickpodUtils.pickpod_whisper(self.audio_draft, self.task_config.language, self.task_config.prompt, self.sentence_draft)
-        self.task_config.language = self.task_config.language if self.task_config.language else self.audio_draft.language
+        try:
+            self.pickpod_flow().run()
+        finally:
+            self.audio_buffer = None
+
+    def pickpod_flow(self, stage_name: List[str] = None) -> PickpodFlow:
+        """
+        Build the flow of the given stages (download, decode, transcribe, diarize, align, combine, keyword, summary, view, persist).
+        Stages disabled by the task configuration are left out.
+        Claude stages always run concurrently, while diarization waits for transcription unless configured as concurrent.
+        In combined mode, keyword, summary and view wait for the single combined request and reuse its result.
+        """
+        stage_name = stage_name if stage_name else STAGE_TASK
+        stage_config = {
+            "diarize": self.task_config.pipeline,
+            "align": self.task_config.pipeline,
+            "combine": self.task_config.claude_combine and any([self.task_config.keyword and self.task_config.keyword_backend != "local", self.task_config.summary, self.task_config.view]),
+            "keyword": self.task_config.keyword,
+            "summary": self.task_config.summary,
+            "view": self.task_config.view
+            }
+        stage_list = [x for x in [
+            PickpodStage("download", self.pickpod_download),
+            PickpodStage("decode", self.pickpod_decode, ["download"]),
+            PickpodStage("transcribe", self.pickpod_transcribe, ["decode"]),
+            PickpodStage("diarize", self.pickpod_diarize, ["decode"], [] if self.task_config.concurrent else ["transcribe"]),
+            PickpodStage("align", self.pickpod_align, ["transcribe", "diarize"]),
+            PickpodStage("combine", self.pickpod_combine, ["transcribe"]),
+            PickpodStage("keyword", self.pickpod_keyword, ["transcribe", "combine"]),
+            PickpodStage("summary", self.pickpod_summary, ["transcribe", "combine"]),
+            PickpodStage("view", self.pickpod_view, ["transcribe", "combine"]),
+            PickpodStage("persist", self.pickpod_persist, ["transcribe"], ["align", "keyword", "summary", "view"])
+            ] if x.name in stage_name and stage_config.get(x.name, True)]
+        if self.task_config.concurrent and self.task_config.pipeline and "transcribe" in stage_name and "diarize" in stage_name:
+            self.thread_whisper, self.thread_pyannote = PickpodUtils.get_thread_budget(self.task_config.thread_whisper, self.task_config.thread_pyannote)
+            print(f"Running transcription ({self.thread_whisper} threads) and speaker diarization ({self.thread_pyannote} threads) concurrently.")
+        return PickpodFlow(stage_list, 4)
+
+    def pickpod_download(self, emit: Callable[[Any], None] = None) -> None:
+        ydl_option = dict(self.task_config.ydl_option)
+        if not ydl_option.get("outtmpl"):
+            ydl_option["outtmpl"] = f"{self.task_config.path_audio}/{self.audio_draft.uuid}.%(ext)s"
+        if not ydl_option.get("proxy") and self.task_config.proxy:
+            ydl_option["proxy"] = self.task_config.proxy
+        PickpodUtils.pickpod_ytdlp(self.audio_draft, ydl_option)
+
+    def pickpod_decode(self, emit: Callable[[Any], None] = None) -> None:
+        self.audio_buffer = PickpodUtils.pickpod_decode(self.audio_draft)
+
+    def pickpod_transcribe(self, emit: Callable[[Any], None] = None) -> float:
+        task_probability = PickpodUtils.pickpod_whisper(self.audio_draft, self.task_config.language, self.task_config.prompt, self.sentence_draft, cpu_threads=self.thread_whisper, audio_buffer=self.audio_buffer, sentence_hook=emit)
+        self.task_language = self.task_config.language if self.task_config.language else self.audio_draft.language
         self.sentence_text = " ".join([x.content for x in self.sentence_draft])
-        print(f"The transcription is done, using time: {time.time() - start_time} s")
+        return task_probability
 
-        if self.task_config.pipeline:
-            start_time = time.time()
-            self.sentence_pipeline = PickpodUtils.pickpod_pyannote(self.audio_draft, self.task_config.hugging_face, self.task_config.path_wav)
-            print(f"The speaker diarization is done, using time: {time.time() - start_time} s")
+    def pickpod_diarize(self, emit: Callable[[Any], None] = None) -> None:
+        with PickpodUtils.torch_thread(self.thread_pyannote):
+            self.sentence_pipeline = PickpodUtils.pickpod_pyannote(self.audio_draft, self.task_config.hugging_face, self.task_config.path_wav, self.task_config.path_pyannote, self.audio_buffer)
+
+    def pickpod_align(self, emit: Callable[[Any], None] = None) -> None:
+        self.audio_buffer = None
+        if self.task_config.pipeline_split:
+            self.sentence_draft = PickpodUtils.split_speaker_by_time(self.sentence_draft, self.sentence_pipeline)
+        else:
             PickpodUtils.get_speaker_by_time(self.sentence_draft, self.sentence_pipeline)
+
+    def pickpod_combine(self, emit: Callable[[Any], None] = None) -> Dict[str, list]:
+        if self.task_config.claude_chunk and len(self.sentence_text) > self.task_config.claude_chunk:
+            self.claude_combine = dict()
+        elif self.task_language == "zh":
+            self.claude_combine = self.claude_client.get_combine_zh(self.audio_draft.duration, self.sentence_text)
         else:
-            print("The speaker diarization has skipped.")
+            self.claude_combine = self.claude_client.get_combine_en(self.audio_draft.duration, self.sentence_text)
+        return self.claude_combine
 
-        if self.task_config.keyword:
-            print("Getting audio keywords.")
-            if self.task_config.language == "zh":
-                self.audio_draft.keyword = "\n".join(self.claude_client.get_keyword_zh(self.sentence_text))
-            else:
-                self.audio_draft.keyword = "\n".join(self.claude_client.get_keyword_en(self.sentence_text))
+    def pickpod_keyword(self, emit: Callable[[Any], None] = None) -> str:
+        if self.task_config.keyword_backend == "local":
+            pickpod_keyword = PickpodKeyword(self.task_config.path_db)
+            pickpod_keyword.refresh()
+            self.audio_draft.keyword = "\n".join(pickpod_keyword.get_keyword(self.sentence_text))
+        elif self.task_config.claude_chunk and len(self.sentence_text) > self.task_config.claude_chunk:
+            self.audio_draft.keyword = "\n".join(self.claude_client.get_keyword_chunk(self.task_language, [(x.start, x.end, x.content) for x in self.sentence_draft], self.task_config.claude_chunk))
+        elif "keyword" in self.claude_combine:
+            self.audio_draft.keyword = "\n".join(self.claude_combine["keyword"])
+        elif self.task_language == "zh":
+            self.audio_draft.keyword = "\n".join(self.claude_client.get_keyword_zh(self.sentence_text))
         else:
-            print("The claude keywords have skipped.")
-
-        if self.task_config.summary:
-            print("Getting audio summary.")
-            if self.task_config.language == "zh":
-                self.summary_draft = [
-                    SummaryDraft(
-                        summary_aid=self.audio_draft.uuid,
-                        summary_content=x[1],
-                        summary_start=x[0]
-                        )
-                    for x in self.claude_client.get_summary_zh(self.audio_draft.duration, self.sentence_text)
-                    ]
-            else:
-                self.summary_draft = [
-                    SummaryDraft(
-                        summary_aid=self.audio_draft.uuid,
-                        summary_content=x[1],
-                        summary_start=x[0]
-                        )
-                    for x in self.claude_client.get_summary_en(self.audio_draft.duration, self.sentence_text)
-                    ]
+            self.audio_draft.keyword = "\n".join(self.claude_client.get_keyword_en(self.sentence_text))
+        return self.audio_draft.keyword
+
+    def pickpod_summary(self, emit: Callable[[Any], None] = None) -> List[SummaryDraft]:
+        if self.task_config.claude_chunk and len(self.sentence_text) > self.task_config.claude_chunk:
+            claude_summary = self.claude_client.get_summary_chunk(self.task_language, self.audio_draft.duration, [(x.start, x.end, x.content) for x in self.sentence_draft], self.task_config.claude_chunk)
+        elif "summary" in self.claude_combine:
+            claude_summary = self.claude_combine["summary"]
+        elif self.task_config.claude_stream:
+            self.summary_draft = list()
+            for sd in self.claude_client.get_summary_stream(self.task_language, self.audio_draft.duration, self.sentence_text, self.audio_draft.uuid):
+                self.summary_draft.append(sd)
+                if emit:
+                    emit(sd)
+            return self.summary_draft
+        elif self.task_language == "zh":
+            claude_summary = self.claude_client.get_summary_zh(self.audio_draft.duration, self.sentence_text)
         else:
-            print("The claude summary has skipped.")
-
-        if self.task_config.view:
-            print("Getting audio views.")
-            if self.task_config.language == "zh":
-                self.view_draft = [
-                    ViewDraft(
-                        view_aid=self.audio_draft.uuid,
-                        view_content=x
-                        )
-                    for x in self.claude_client.get_view_zh(self.sentence_text)
-                    ]
-            else:
-                self.view_draft = [
-                    ViewDraft(
-                        view_aid=self.audio_draft.uuid,
-                        view_content=x
-                        )
-                    for x in self.claude_client.get_view_en(self.sentence_text)
-                    ]
+            claude_summary = self.claude_client.get_summary_en(self.audio_draft.duration, self.sentence_text)
+        self.summary_draft = [
+            SummaryDraft(
+                summary_aid=self.audio_draft.uuid,
+                summary_content=x[1],
+                summary_start=x[0]
+                )
+            for x in claude_summary
+            ]
+        return self.summary_draft
+
+    def pickpod_view(self, emit: Callable[[Any], None] = None) -> List[ViewDraft]:
+        if self.task_config.claude_chunk and len(self.sentence_text) > self.task_config.claude_chunk:
+            claude_view = self.claude_client.get_view_chunk(self.task_language, [(x.start, x.end, x.content) for x in self.sentence_draft], self.task_config.claude_chunk)
+        elif "view" in self.claude_combine:
+            claude_view = self.claude_combine["view"]
+        elif self.task_config.claude_stream:
+            self.view_draft = list()
+            for vd in self.claude_client.get_view_stream(self.task_language, self.sentence_text, self.audio_draft.uuid):
+                self.view_draft.append(vd)
+                if emit:
+                    emit(vd)
+            return self.view_draft
+        elif self.task_language == "zh":
+            claude_view = self.claude_client.get_view_zh(self.sentence_text)
         else:
-            print("The claude views have skipped.")
+            claude_view = self.claude_client.get_view_en(self.sentence_text)
+        self.view_draft = [
+            ViewDraft(
+                view_aid=self.audio_draft.uuid,
+                view_content=x
+                )
+            for x in claude_view
+            ]
+        return self.view_draft
+
+    def pickpod_persist(self, emit: Callable[[Any], None] = None) -> None:
+        self.save_to_db()
 
     def audio_safe_name(self) -> str:
         return self.audio_draft.title \
@@ -177,14 +263,15 @@ class PickpodTask(object):
             f.write(self.__str__)
 
     def save_to_db(self) -> None:
-        db_client = DBClient(self.task_config.path_db)
-        db_sql = [self.audio_draft.insert()]
-        for sd in self.sentence_draft:
-            db_sql.append(sd.insert())
-        for sd in self.summary_draft:
-            db_sql.append(sd.insert())
-        for vd in self.view_draft:
-            db_sql.append(vd.insert())
-        for x, y in db_sql:
-            db_client.execute(x, y)
-        db_client.close()
+        db_client = DBClient(self.task_config.path_db, verbose=False)
+        try:
+            db_client.migrate()
+            row_count = db_client.executemany([
+                AudioDraft.insert_many([self.audio_draft]),
+                SentenceDraft.insert_many(self.sentence_draft),
+                SummaryDraft.insert_many(self.summary_draft),
+                ViewDraft.insert_many(self.view_draft)
+                ])
+            print(f"Pickpod task saved, affected rows: {row_count}")
+        finally:
+            db_client.close()
@@ -3,19 +3,26 @@
 
 import gc
 import os
+from contextlib import contextmanager
 from queue import Queue
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
+import numpy as np
 import opencc
 import torch
 import torchaudio
 import yt_dlp
-from faster_whisper import WhisperModel
-from pyannote.audio import Pipeline
+from faster_whisper import decode_audio
 from pyannote.audio.pipelines.utils.hook import ProgressHook
 from pydub import AudioSegment
+from pydub.utils import mediainfo
 
 from pickpod.draft import AudioDraft, SentenceDraft
+from pickpod.model import PyannoteRegistry, WhisperRegistry
+
+
+# Sample rate of the shared PCM buffer (required by faster_whisper and pyannote.audio)
+SAMPLE_RATE = 16000
 
 
 class PickpodUtils(object):
@@ -33,18 +40,86 @@ class PickpodUtils(object):
             return 0.0
         return intersection / union
 
+    @staticmethod
+    def get_turn_by_time(sentence_stamp: List[SentenceDraft], pyannote_stamp: List[Any]) -> Iterator[Tuple[SentenceDraft, List[tuple]]]:
+        """
+        Sweep the sorted intervals and yield each sentence with the speaker turns that may overlap it
+        """
+        pyannote_turn = sorted(
+            [(x[0], int(x[2][8:]), i) for i, x in enumerate(pyannote_stamp)],
+            key=lambda x: x[0].start
+            )
+        turn_index, turn_active = 0, list()
+        for sentence in sorted(sentence_stamp, key=lambda x: x.start):
+            while turn_index < len(pyannote_turn) and pyannote_turn[turn_index][0].start < sentence.end:
+                turn_active.append(pyannote_turn[turn_index])
+                turn_index += 1
+            turn_active = [x for x in turn_active if x[0].end > sentence.start]
+            yield sentence, turn_active
+
     @staticmethod
     def get_speaker_by_time(sentence_stamp: List[SentenceDraft], pyannote_stamp: List[Any]) -> None:
         """
         Align the timestamps
         """
-        for sentence in sentence_stamp:
-            max_overlap = -1
-            for pyannote in pyannote_stamp:
-                overlap = PickpodUtils.get_overlap(sentence, pyannote[0])
-                if overlap > max_overlap:
-                    max_overlap = overlap
-                    sentence.speaker = int(pyannote[2][8:])
+        if not pyannote_stamp:
+            return
+        speaker_default = int(pyannote_stamp[0][2][8:])
+        for sentence, turn_active in PickpodUtils.get_turn_by_time(sentence_stamp, pyannote_stamp):
+            max_overlap, max_index = 0.0, -1
+            sentence.speaker = speaker_default
+            for turn, speaker, index in turn_active:
+                overlap = PickpodUtils.get_overlap(sentence, turn)
+                if overlap > max_overlap or (overlap == max_overlap and overlap > 0 and index < max_index):
+                    max_overlap, max_index = overlap, index
+                    sentence.speaker = speaker
+
+    @staticmethod
+    def split_speaker_by_time(sentence_stamp: List[SentenceDraft], pyannote_stamp: List[Any], min_duration: float = 1.0) -> List[SentenceDraft]:
+        """
+        Align the timestamps and split a sentence where the speaker changes
+        """
+        PickpodUtils.get_speaker_by_time(sentence_stamp, pyannote_stamp)
+        sentence_split = dict()
+        for sentence, turn_active in PickpodUtils.get_turn_by_time(sentence_stamp, pyannote_stamp):
+            speaker_run = list()
+            for turn, speaker, _ in sorted(turn_active, key=lambda x: x[0].start):
+                run_start = max(turn.start, sentence.start, speaker_run[-1][1] if speaker_run else sentence.start)
+                run_end = min(turn.end, sentence.end)
+                if run_end <= run_start:
+                    continue
+                if speaker_run and speaker_run[-1][2] == speaker:
+                    speaker_run[-1][1] = run_end
+                else:
+                    speaker_run.append([run_start, run_end, speaker])
+            speaker_run = [x for x in speaker_run if x[1] - x[0] >= min_duration]
+            speaker_run = [x for i, x in enumerate(speaker_run) if i == 0 or x[2] != speaker_run[i - 1][2]]
+            if len(speaker_run) < 2:
+                continue
+            sentence_part, content_index = list(), 0
+            for i, (run_start, run_end, speaker) in enumerate(speaker_run):
+                part_start = sentence.start if i == 0 else run_start
+                part_end = sentence.end if i == len(speaker_run) - 1 else speaker_run[i + 1][0]
+                content_end = len(sentence.content) if i == len(speaker_run) - 1 else round(len(sentence.content) * (part_end - sentence.start) / (sentence.end - sentence.start))
+                content_space = sentence.content.rfind(" ", content_index, content_end + 1)
+                if content_end < len(sentence.content) and content_space > content_index:
+                    content_end = content_space
+                part_content = sentence.content[content_index:content_end].strip()
+                content_index = content_end
+                if not part_content:
+                    continue
+                sentence_part.append(SentenceDraft(
+                    sentence_uuid=sentence.uuid if not sentence_part else "",
+                    sentence_aid=sentence.aid,
+                    sentence_content=part_content,
+                    sentence_start=round(part_start, 3),
+                    sentence_end=round(part_end, 3),
+                    sentence_speaker=speaker,
+                    sentence_status=sentence.status
+                    ))
+            if len(sentence_part) > 1:
+                sentence_split[sentence.uuid] = sentence_part
+        return [y for x in sentence_stamp for y in sentence_split.get(x.uuid, [x])]
 
     @staticmethod
     def pickpod_ytdlp(audio_draft: AudioDraft, ydl_option: Dict[str, Any]) -> None:
@@ -65,19 +140,42 @@ class PickpodUtils(object):
             audio_draft.ext = os.path.splitext(ydl_json.get("filepath", ""))[1][1:]
         audio_draft.path = ydl_json.get("filepath", "")
         if not audio_draft.duration:
-            audio_draft.duration = len(AudioSegment.from_file(audio_draft.path)) / 1000
+            audio_draft.duration = PickpodUtils.get_duration(audio_draft.path)
+
+    @staticmethod
+    def get_duration(audio_path: str, audio_buffer: np.ndarray = None) -> float:
+        """
+        Get audio duration from the decoded buffer or the file header
+        """
+        if audio_buffer is not None:
+            return len(audio_buffer) / SAMPLE_RATE
+        try:
+            return round(float(mediainfo(audio_path).get("duration", 0)), 3)
+        except Exception as e:
+            print("Duration probe failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+            return len(AudioSegment.from_file(audio_path)) / 1000
+
+    @staticmethod
+    def pickpod_decode(audio_draft: AudioDraft) -> np.ndarray:
+        """
+        Decode audio once to 16 kHz mono float32
+        """
+        audio_buffer = decode_audio(audio_draft.path, sampling_rate=SAMPLE_RATE)
+        if not audio_draft.duration:
+            audio_draft.duration = PickpodUtils.get_duration(audio_draft.path, audio_buffer)
+        return audio_buffer
 
     @staticmethod
-    def pickpod_whisper(audio_draft: AudioDraft, task_language: str = None, task_prompt: str = None, sentence_draft: Queue or List = None, model_file: str = "large-v3") -> float:
+    def pickpod_whisper(audio_draft: AudioDraft, task_language: str = None, task_prompt: str = None, sentence_draft: Queue or List = None, model_file: str = "large-v3", cpu_threads: int = 0, audio_buffer: np.ndarray = None, sentence_hook: Callable[[SentenceDraft], None] = None) -> float:
         """
         Get audio document with faster_whisper
         """
         if torch.cuda.is_available():
-            whisper_model = WhisperModel(model_file, device="cuda", compute_type="float16")
+            whisper_model = WhisperRegistry.get_model(model_file, "cuda", "float16", cpu_threads)
         else:
-            whisper_model = WhisperModel(model_file, device="cpu", compute_type="int8")
+            whisper_model = WhisperRegistry.get_model(model_file, "cpu", "int8", cpu_threads)
         whisper_segments, whisper_info = whisper_model.transcribe(
-            audio_draft.path,
+            audio_draft.path if audio_buffer is None else audio_buffer,
             language=task_language,
             initial_prompt=task_prompt
         )
@@ -94,22 +192,20 @@ class PickpodUtils(object):
                 sentence_draft.append(sd)
             elif isinstance(sentence_draft, Queue):
                 sentence_draft.put(sd)
+            if sentence_hook:
+                sentence_hook(sd)
         return whisper_info.language_probability * 100.0
 
     @staticmethod
-    def pickpod_pyannote(audio_draft: AudioDraft, key_hugging_face: str, path_wav: str) -> List[Any]:
+    def pickpod_pyannote(audio_draft: AudioDraft, key_hugging_face: str, path_wav: str, path_pyannote: str = "", audio_buffer: np.ndarray = None) -> List[Any]:
         """
         Execute speaker diarization with pyannote.audio
         """
-        pyannote_pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization-3.0", use_auth_token=key_hugging_face)
-        if torch.cuda.is_available():
-            try:
-                pyannote_pipeline.to(torch.device("cuda"))
-            except Exception as e:
-                pyannote_pipeline.to(torch.device("cpu"))
-                print("CUDA pyannote failed, CODE: {}, INFO: {}.".format(e.args[0], e.args[-1]))
+        pyannote_pipeline = PyannoteRegistry.get_pipeline(key_hugging_face, path_pyannote)
         with ProgressHook() as hook:
-            if audio_draft.ext.lower() != "wav":
+            if audio_buffer is not None:
+                waveform, sample_rate = torch.from_numpy(audio_buffer).unsqueeze(0), SAMPLE_RATE
+            elif audio_draft.ext.lower() != "wav":
                 path_wav = f"{path_wav}/{audio_draft.uuid}.wav"
                 pyannote_wav = AudioSegment.from_file(audio_draft.path)
                 pyannote_wav.export(path_wav, format="wav")
@@ -120,9 +216,38 @@ class PickpodUtils(object):
         return list(pyannote_stamp.itertracks(yield_label=True))
 
     @staticmethod
-    def static_clean() -> None:
+    def get_thread_budget(thread_whisper: int = 0, thread_pyannote: int = 0) -> Tuple[int, int]:
+        """
+        Split CPU cores between concurrent transcription and speaker diarization
+        """
+        cpu_count = os.cpu_count() or 2
+        if not thread_whisper and not thread_pyannote:
+            thread_whisper = max(cpu_count - cpu_count // 2, 1)
+        thread_whisper = thread_whisper if thread_whisper else max(cpu_count - thread_pyannote, 1)
+        thread_pyannote = thread_pyannote if thread_pyannote else max(cpu_count - thread_whisper, 1)
+        return thread_whisper, thread_pyannote
+
+    @staticmethod
+    @contextmanager
+    def torch_thread(thread_num: int = 0) -> Iterator[None]:
+        """
+        Limit the torch threads of the process within the block (0 for unchanged), restoring them afterwards
+        """
+        thread_last = torch.get_num_threads()
+        if thread_num:
+            torch.set_num_threads(thread_num)
+        try:
+            yield
+        finally:
+            torch.set_num_threads(thread_last)
+
+    @staticmethod
+    def static_clean(unload_model: bool = True) -> None:
         """
         Clean all cache
         """
+        if unload_model:
+            WhisperRegistry.unload()
+            PyannoteRegistry.unload()
         gc.collect()
         torch.cuda.empty_cache()
@@ -31,6 +31,7 @@ REQUIRED = [
 # What packages are optional?
 EXTRAS = {
     "app": ["python-dotenv", "streamlit"],
+    "rank": ["jieba"],
 }
 
 # The rest you shouldn't have to touch too much :)
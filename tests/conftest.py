@@ -0,0 +1,60 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def sse_frame(event: str = "completion", data: dict = None) -> str:
+    """
+    Format a server-sent event of the Claude streaming API
+    """
+    return f"event: {event}\ndata: {json.dumps(data if data is not None else dict())}\n\n"
+
+
+class SSEHandler(BaseHTTPRequestHandler):
+    """
+    Stub of the Claude streaming API sending the frames of the server in chunks,
+    where a None frame waits until the test sets the release event
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def send_chunk(self, text: str = "") -> None:
+        chunk = text.encode("utf-8")
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self) -> None:
+        self.server.request_body.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for frame in self.server.frame:
+            if frame is None:
+                self.server.release.wait(5)
+            else:
+                self.send_chunk(frame)
+        self.send_chunk()
+
+
+@pytest.fixture
+def sse_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SSEHandler)
+    server.daemon_threads = True
+    server.frame = list()
+    server.release = threading.Event()
+    server.request_body = list()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/v1/complete"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,88 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import random
+from types import SimpleNamespace
+from typing import Any, List
+
+import pytest
+
+from pickpod.draft import SentenceDraft
+from pickpod.utils import PickpodUtils
+
+
+def get_speaker_reference(sentence_stamp: List[SentenceDraft], pyannote_stamp: List[Any]) -> None:
+    """
+    The nested loop used before the interval sweep
+    """
+    for sentence in sentence_stamp:
+        max_overlap = -1
+        for pyannote in pyannote_stamp:
+            overlap = PickpodUtils.get_overlap(sentence, pyannote[0])
+            if overlap > max_overlap:
+                max_overlap = overlap
+                sentence.speaker = int(pyannote[2][8:])
+
+
+def make_turn(turn_start: float, turn_end: float, speaker: int) -> tuple:
+    return SimpleNamespace(start=turn_start, end=turn_end), None, f"SPEAKER_{speaker:02d}"
+
+
+def make_sentence(sentence_start: float, sentence_end: float, sentence_content: str = "") -> SentenceDraft:
+    return SentenceDraft(sentence_content=sentence_content, sentence_start=sentence_start, sentence_end=sentence_end, sentence_speaker=99)
+
+
+def assert_same_speaker(sentence_range: List[tuple], turn_range: List[tuple]) -> None:
+    pyannote_stamp = [make_turn(*x) for x in turn_range]
+    sentence_sweep = [make_sentence(*x) for x in sentence_range]
+    sentence_loop = [make_sentence(*x) for x in sentence_range]
+    PickpodUtils.get_speaker_by_time(sentence_sweep, pyannote_stamp)
+    get_speaker_reference(sentence_loop, pyannote_stamp)
+    assert [x.speaker for x in sentence_sweep] == [x.speaker for x in sentence_loop]
+
+
+@pytest.mark.parametrize("sentence_range, turn_range", [
+    # zero-length sentences
+    ([(1, 1), (3, 3), (0, 0)], [(0, 2, 1), (2, 4, 2)]),
+    # no overlap with any turn
+    ([(10, 12), (0, 1)], [(2, 3, 1), (4, 5, 2)]),
+    # ties between turns covering the same share
+    ([(0, 4)], [(2, 4, 3), (0, 2, 1)]),
+    ([(0, 4)], [(0, 2, 1), (2, 4, 3), (1, 3, 2)]),
+    # overlapping turns
+    ([(0, 5), (4, 9), (8, 10)], [(0, 6, 1), (3, 10, 2), (7, 9, 3)]),
+    # unsorted sentences and turns
+    ([(6, 8), (0, 2), (3, 5)], [(5, 9, 2), (0, 4, 1)]),
+    # no pyannote turns
+    ([(0, 1), (1, 2)], []),
+])
+def test_speaker_edge(sentence_range, turn_range):
+    assert_same_speaker(sentence_range, turn_range)
+
+
+def test_speaker_random():
+    random_state = random.Random(0)
+    for _ in range(1000):
+        sentence_range = list()
+        for _ in range(random_state.randint(0, 20)):
+            sentence_start = random_state.randint(0, 40) / 2
+            sentence_range.append((sentence_start, sentence_start + random_state.randint(0, 8) / 2))
+        turn_range = list()
+        for _ in range(random_state.randint(0, 10)):
+            turn_start = random_state.randint(0, 40) / 2
+            turn_range.append((turn_start, turn_start + random_state.randint(1, 12) / 2, random_state.randint(0, 3)))
+        assert_same_speaker(sentence_range, turn_range)
+
+
+def test_split_speaker_change():
+    sentence = make_sentence(0, 10, "hello there how are you today my friend")
+    sentence_split = PickpodUtils.split_speaker_by_time([sentence], [make_turn(0, 5, 1), make_turn(5, 10, 2)])
+    assert [(x.start, x.end, x.speaker) for x in sentence_split] == [(0, 5, 1), (5, 10, 2)]
+    assert " ".join([x.content for x in sentence_split]) == sentence.content
+    assert sentence_split[0].uuid == sentence.uuid
+
+
+def test_split_speaker_short_run():
+    sentence = make_sentence(0, 10, "hello there how are you today")
+    sentence_split = PickpodUtils.split_speaker_by_time([sentence], [make_turn(0, 9.5, 1), make_turn(9.5, 10, 2)])
+    assert len(sentence_split) == 1 and sentence_split[0].speaker == 1
@@ -0,0 +1,112 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import threading
+
+from pickpod.api import ClaudeCache
+from pickpod.config import DBCache, DBClient, DBUnit
+from pickpod.draft import SentenceDraft, ViewDraft
+from pickpod.rank import PickpodKeyword
+
+
+def make_db(tmp_path, db_cache: DBCache = None) -> DBClient:
+    db_client = DBClient(str(tmp_path), verbose=False, db_cache=db_cache)
+    db_client.create_tb()
+    return db_client
+
+
+def test_owner_bounded_by_entry(tmp_path):
+    db_cache = DBCache(max_entry=5)
+    db_client = make_db(tmp_path, db_cache)
+    for i in range(50):
+        db_client.executemany([SentenceDraft.insert_many([
+            SentenceDraft(sentence_aid=f"audio_{i}", sentence_content=f"sentence {j}", sentence_start=j, sentence_end=j + 1) for j in range(100)
+            ])])
+        db_client.fetchall(*SentenceDraft.select_by_aid(f"audio_{i}"))
+    assert len(db_cache.entry) == 5
+    assert len(db_cache.owner) == 500
+    assert db_cache.size == sum([db_cache.get_size(y) for x in db_cache.entry.values() for y in x.values()])
+
+
+def test_put_overwrite_size(tmp_path):
+    db_cache = DBCache()
+    sql, arg = SentenceDraft.select_by_aid("audio")
+    db_cache.put(sql, arg, [("uuid", "audio", "content")])
+    db_cache.put(sql, arg, [("uuid", "audio", "content")])
+    assert db_cache.size == db_cache.get_size([("uuid", "audio", "content")])
+
+
+def test_only_draft_read_cached(tmp_path):
+    db_cache = DBCache()
+    db_client = make_db(tmp_path, db_cache)
+    db_client.executemany([SentenceDraft.insert_many([
+        SentenceDraft(sentence_aid="audio", sentence_content="a sentence long enough", sentence_start=0, sentence_end=1)
+        ])])
+    PickpodKeyword(str(tmp_path)).refresh()
+    assert not db_cache.entry and not db_cache.owner
+
+
+def test_update_invalidates(tmp_path):
+    db_client = make_db(tmp_path, DBCache())
+    view_draft = ViewDraft(view_aid="audio", view_content="view", view_value=True)
+    db_client.execute(*view_draft.insert())
+    assert ViewDraft.db_init(db_client.fetchall(*ViewDraft.select_by_aid("audio"))[0]).content == "view"
+    view_draft.content = "changed"
+    db_client.execute(*view_draft.update())
+    assert ViewDraft.db_init(db_client.fetchall(*ViewDraft.select_by_aid("audio"))[0]).content == "changed"
+
+
+def test_claude_cache_shared(tmp_path):
+    claude_cache = ClaudeCache.get_cache(str(tmp_path))
+    assert ClaudeCache.get_cache(str(tmp_path / ".")) is claude_cache
+    claude_cache.close()
+    assert ClaudeCache.get_cache(str(tmp_path)) is not claude_cache
+
+
+def test_claude_cache_evict(tmp_path):
+    claude_cache = ClaudeCache(str(tmp_path), max_byte=25)
+    for i in range(5):
+        claude_cache.put({"prompt": i}, "0123456789")
+    assert sum([claude_cache.get({"prompt": i}) is not None for i in range(5)]) == 2
+
+
+def test_connection_reuse(tmp_path):
+    db_client = make_db(tmp_path)
+    db_client.close()
+    conn_list = list()
+
+    def thread_run() -> None:
+        conn_list.append(db_client.conn)
+        db_client.fetchall(*SentenceDraft.select_by_aid("audio"))
+        db_client.close()
+
+    for _ in range(3):
+        db_thread = threading.Thread(target=thread_run)
+        db_thread.start()
+        db_thread.join()
+    assert len(set([id(x) for x in conn_list])) == 1
+    assert len(db_client.pool.idle) == 1
+
+
+def test_pool_shared_cache(tmp_path):
+    db_client_a = make_db(tmp_path, DBCache())
+    db_client_b = DBClient(str(tmp_path), verbose=False, db_cache=DBCache())
+    assert db_client_b.pool.cache is db_client_a.pool.cache
+    view_draft = ViewDraft(view_aid="audio", view_content="view", view_value=True)
+    db_client_a.execute(*view_draft.insert())
+    assert ViewDraft.db_init(db_client_b.fetchall(*ViewDraft.select_by_aid("audio"))[0]).content == "view"
+    view_draft.content = "changed"
+    db_client_a.execute(*view_draft.update())
+    assert ViewDraft.db_init(db_client_b.fetchall(*ViewDraft.select_by_aid("audio"))[0]).content == "changed"
+
+
+def test_unit_add(tmp_path):
+    db_client = make_db(tmp_path, DBCache())
+    db_unit = DBUnit(db_client)
+    view_draft = ViewDraft(view_aid="audio", view_content="view", view_value=True)
+    db_unit.add(view_draft)
+    assert db_unit.flush() == 1
+    view_draft.content = "changed"
+    assert db_unit.dirty() == [view_draft]
+    db_unit.flush()
+    assert [ViewDraft.db_init(x).content for x in db_client.fetchall(*ViewDraft.select_by_aid("audio"))] == ["changed"]
@@ -0,0 +1,25 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+from pickpod.api import ClaudeClient
+from pickpod.config import TaskConfig
+from pickpod.draft import AudioDraft, SentenceDraft
+from pickpod.task import PickpodTask
+
+
+def test_keyword_chunk(monkeypatch, tmp_path):
+    claude_prompt = list()
+
+    def get_completion(self, prompt: str = "") -> str:
+        claude_prompt.append(prompt)
+        return "Keywords:\n\n1. Alpha\n2. Beta" if "first" in prompt else "Keywords:\n\n1. beta\n2. Gamma"
+
+    monkeypatch.setattr(ClaudeClient, "get_completion", get_completion)
+    pickpod_task = PickpodTask(AudioDraft(), TaskConfig(path_db=str(tmp_path), task_language="en", claude_chunk=30))
+    pickpod_task.sentence_draft = [
+        SentenceDraft(sentence_content="the first sentence of the episode", sentence_start=0, sentence_end=5),
+        SentenceDraft(sentence_content="the second sentence of the episode", sentence_start=5, sentence_end=10)
+        ]
+    pickpod_task.sentence_text = " ".join([x.content for x in pickpod_task.sentence_draft])
+    assert pickpod_task.pickpod_keyword().split("\n") == ["Beta", "Alpha", "Gamma"]
+    assert len(claude_prompt) == 2 and all([pickpod_task.sentence_text not in x for x in claude_prompt])
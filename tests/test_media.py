@@ -0,0 +1,76 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pickpod.config import DBClient
+from pickpod.draft import AudioDraft
+from pickpod.media import PickpodMedia
+
+
+@pytest.fixture
+def media_audio(tmp_path):
+    db_client = DBClient(str(tmp_path), verbose=False)
+    db_client.create_tb()
+    audio_path = os.path.join(str(tmp_path), "audio.mp3")
+    with open(audio_path, "wb") as f:
+        f.write(os.urandom(100000))
+    audio_draft = AudioDraft(audio_title="audio", audio_ext="mp3", audio_path=audio_path)
+    db_client.execute(*audio_draft.insert())
+    pickpod_media = PickpodMedia(str(tmp_path), media_port=0).start()
+    yield pickpod_media, f"http://127.0.0.1:{pickpod_media.port}", audio_draft
+    pickpod_media.stop()
+
+
+def get_response(media_url: str, media_header: dict = None, media_method: str = "GET") -> tuple:
+    try:
+        with urllib.request.urlopen(urllib.request.Request(media_url, headers=media_header if media_header else dict(), method=media_method)) as f:
+            return f.status, f.headers, f.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, b""
+
+
+def test_audio_range(media_audio):
+    pickpod_media, media_url, audio_draft = media_audio
+    with open(audio_draft.path, "rb") as f:
+        audio_bytes = f.read()
+    audio_url = pickpod_media.get_audio_url(media_url, audio_draft.uuid)
+    assert get_response(audio_url)[2] == audio_bytes
+    status, header, body = get_response(audio_url, {"Range": "bytes=100-199"})
+    assert (status, header["Content-Range"], body) == (206, "bytes 100-199/100000", audio_bytes[100:200])
+    status, header, body = get_response(audio_url, {"Range": "bytes=-10"})
+    assert (status, body) == (206, audio_bytes[-10:])
+    status, header, _ = get_response(audio_url, {"Range": "bytes=100000-"})
+    assert (status, header["Content-Range"]) == (416, "bytes */100000")
+    status, header, body = get_response(audio_url, media_method="HEAD")
+    assert (status, header["Content-Length"], body) == (200, "100000", b"")
+    assert "Access-Control-Allow-Origin" not in header
+
+
+def test_audio_token(media_audio):
+    pickpod_media, media_url, audio_draft = media_audio
+    assert get_response(f"{media_url}/audio/{audio_draft.uuid}")[0] == 403
+    assert get_response(f"{media_url}/audio/{audio_draft.uuid}?token=%E4%BD%A0")[0] == 403
+    assert get_response(pickpod_media.get_audio_url(media_url, "missing"))[0] == 404
+    _, header, _ = get_response(pickpod_media.get_audio_url(media_url, audio_draft.uuid, "音频.mp3"))
+    assert header["Content-Disposition"] == "attachment; filename*=UTF-8''%E9%9F%B3%E9%A2%91.mp3"
+
+
+def test_clip_limit(media_audio):
+    pickpod_media, media_url, audio_draft = media_audio
+    assert get_response(pickpod_media.get_clip_url(media_url, audio_draft.uuid, 10, 5))[0] == 400
+    for _ in range(pickpod_media.max_clip):
+        pickpod_media.server.clip_semaphore.acquire()
+    assert get_response(pickpod_media.get_clip_url(media_url, audio_draft.uuid, 0, 5))[0] == 503
+
+
+def test_media_shared(tmp_path):
+    pickpod_media = PickpodMedia.get_media(str(tmp_path), "127.0.0.1", 0)
+    assert PickpodMedia.get_media(str(tmp_path), "127.0.0.1", 0) is pickpod_media
+    pickpod_media.stop()
+    assert PickpodMedia.get_media(str(tmp_path), "127.0.0.1", 0) is not pickpod_media
+    PickpodMedia.get_media(str(tmp_path), "127.0.0.1", 0).stop()
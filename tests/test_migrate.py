@@ -0,0 +1,17 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+from pickpod.config import DB_MIGRATION, DBClient
+
+
+def test_migrate_without_fts(tmp_path, monkeypatch):
+    db_client = DBClient(str(tmp_path), verbose=False)
+    monkeypatch.setattr(DBClient, "fts_ready", lambda self: False)
+    db_client.create_tb()
+    assert db_client.fetchone("PRAGMA user_version")[0] == len(DB_MIGRATION)
+    assert db_client.fetchone("SELECT count(1) FROM sqlite_master WHERE type=? AND name=?", ("index", "sentence_page"))[0]
+    assert not db_client.has_fts()
+    monkeypatch.undo()
+    assert db_client.migrate() == len(DB_MIGRATION)
+    assert db_client.has_fts()
+    assert db_client.fetchone("PRAGMA user_version")[0] == len(DB_MIGRATION)
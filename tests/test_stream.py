@@ -0,0 +1,68 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import pytest
+from conftest import sse_frame
+
+from pickpod.api import ClaudeCache, ClaudeClient, ClaudeLimiter
+
+
+def test_line_before_end(sse_server):
+    sse_server.frame = [
+        sse_frame("completion", {"completion": "first line\nsec"}),
+        sse_frame("ping"),
+        None,
+        sse_frame("completion", {"completion": "ond line\n"}),
+        sse_frame("completion", {"completion": "last", "stop_reason": "stop_sequence"})
+        ]
+    claude_line = ClaudeClient(claude_url=sse_server.url).get_line_stream("prompt")
+    assert next(claude_line) == "first line"
+    assert not sse_server.release.is_set()
+    sse_server.release.set()
+    assert list(claude_line) == ["second line", "last"]
+    assert sse_server.request_body[0]["stream"] is True
+
+
+def test_error_event(sse_server, tmp_path):
+    sse_server.frame = [
+        sse_frame("completion", {"completion": "partial"}),
+        sse_frame("error", {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+        ]
+    claude_cache = ClaudeCache(str(tmp_path))
+    claude_client = ClaudeClient(claude_url=sse_server.url, claude_cache=claude_cache)
+    with pytest.raises(RuntimeError):
+        list(claude_client.get_stream("prompt"))
+    assert claude_cache.get(dict(claude_client.body, prompt="prompt")) is None
+
+
+def test_stream_cache(sse_server, tmp_path):
+    sse_server.frame = [
+        sse_frame("completion", {"completion": "Hello"}),
+        sse_frame("ping"),
+        sse_frame("completion", {"completion": ", world"})
+        ]
+    claude_cache = ClaudeCache(str(tmp_path))
+    claude_client = ClaudeClient(claude_url=sse_server.url, claude_cache=claude_cache)
+    assert list(claude_client.get_stream("prompt")) == ["Hello", ", world"]
+    assert claude_cache.get(dict(claude_client.body, prompt="prompt")) == "Hello, world"
+    assert list(claude_client.get_stream("prompt")) == ["Hello, world"]
+    assert len(sse_server.request_body) == 1
+
+
+def test_stream_semaphore(sse_server):
+    sse_server.frame = [
+        sse_frame("completion", {"completion": "first"}),
+        None,
+        sse_frame("completion", {"completion": "last"})
+        ]
+    ClaudeLimiter.configure(max_concurrency=1)
+    try:
+        claude_stream = ClaudeClient(claude_url=sse_server.url).get_stream("prompt")
+        assert next(claude_stream) == "first"
+        assert not ClaudeLimiter.semaphore.acquire(blocking=False)
+        sse_server.release.set()
+        assert list(claude_stream) == ["last"]
+        assert ClaudeLimiter.semaphore.acquire(blocking=False)
+        ClaudeLimiter.semaphore.release()
+    finally:
+        ClaudeLimiter.configure()
@@ -0,0 +1,46 @@
+# !/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pickpod import utils
+from pickpod.config import TaskConfig
+from pickpod.draft import AudioDraft
+from pickpod.task import PickpodTask
+from pickpod.utils import PickpodUtils
+
+
+@pytest.fixture
+def torch_thread(monkeypatch):
+    torch_thread = [8]
+    monkeypatch.setattr(utils.torch, "get_num_threads", lambda: torch_thread[0], raising=False)
+    monkeypatch.setattr(utils.torch, "set_num_threads", lambda x: torch_thread.__setitem__(0, x), raising=False)
+    return torch_thread
+
+
+def test_thread_budget(torch_thread):
+    assert PickpodUtils.get_thread_budget(3, 0)[0] == 3
+    assert PickpodUtils.get_thread_budget(0, 2)[1] == 2
+    assert torch_thread[0] == 8
+
+
+def test_torch_thread_restore(torch_thread):
+    with PickpodUtils.torch_thread(2):
+        assert torch_thread[0] == 2
+    assert torch_thread[0] == 8
+    with pytest.raises(RuntimeError):
+        with PickpodUtils.torch_thread(3):
+            raise RuntimeError("diarization failed")
+    assert torch_thread[0] == 8
+    with PickpodUtils.torch_thread(0):
+        assert torch_thread[0] == 8
+
+
+def test_diarize_thread(torch_thread, monkeypatch, tmp_path):
+    diarize_thread = list()
+    monkeypatch.setattr(PickpodUtils, "pickpod_pyannote", lambda *x: diarize_thread.append(torch_thread[0]) or list())
+    pickpod_task = PickpodTask(AudioDraft(), TaskConfig(path_db=str(tmp_path), pipeline=True, concurrent=True, thread_whisper=6, thread_pyannote=2))
+    pickpod_task.pickpod_flow(["decode", "transcribe", "diarize"])
+    assert (pickpod_task.thread_whisper, torch_thread[0]) == (6, 8)
+    pickpod_task.pickpod_diarize()
+    assert (diarize_thread, torch_thread[0]) == ([2], 8)